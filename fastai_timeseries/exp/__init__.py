@@ -10,5 +10,13 @@ from .nb_ColorfulDim import *
 from .nb_Initialization import *
 from .nb_Optimizers import *
 from .rocket_functions import *
+from .minirocket_functions import *
+from .rocket_pruning import *
+from .rocket_ridge import *
+from .rocket_cache import *
+from .rocket_parallel import *
+from .rocket_fft import *
+from .rocket_transformer import *
+from .rocket_quantization import *
 #from .nb_ImageDataAugmentation import *
 #from .nb_NewDataAugmentation import *
\ No newline at end of file
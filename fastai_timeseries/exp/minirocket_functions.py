@@ -0,0 +1,135 @@
+# Angus Dempster, Daniel F Schmidt, Geoffrey I Webb
+
+# Dempster A, Schmidt DF, Webb GI (2020) MINIROCKET: A Very Fast (Almost)
+# Deterministic Transform for Time Series Classification. arXiv:2012.08791
+
+# changes:
+# - same interface as rocket_functions: fit_minirocket (~ generate_kernels) returns the parameters used by
+#   apply_minirocket (~ apply_kernels), which returns a (n_samples, n_features) feature matrix (ppv only)
+# - added seed parameter to fit_minirocket
+# - univariate only: X is (n_samples, seq_len) or (n_samples, 1, seq_len)
+
+from numba import njit, prange
+import numpy as np
+
+# fixed kernels: length 9, weights -1 except for 3 positions with weight 2 (84 combinations)
+_indices = np.array([(i, j, k) for i in range(9) for j in range(i + 1, 9) for k in range(j + 1, 9)], dtype = np.int32)
+
+def _fit_dilations(input_length, num_features, max_dilations_per_kernel):
+    # dilations (up to (input_length - 1) / 8) are spread exponentially and shared by all kernels
+    num_kernels = len(_indices)
+    num_features_per_kernel = num_features // num_kernels
+    true_max_dilations_per_kernel = min(num_features_per_kernel, max_dilations_per_kernel)
+    multiplier = num_features_per_kernel / true_max_dilations_per_kernel
+    max_exponent = np.log2((input_length - 1) / (9 - 1))
+    dilations, num_features_per_dilation = \
+    np.unique(np.logspace(0, max_exponent, true_max_dilations_per_kernel, base = 2).astype(np.int32), return_counts = True)
+    num_features_per_dilation = (num_features_per_dilation * multiplier).astype(np.int32) # this is a vector
+    remainder = num_features_per_kernel - np.sum(num_features_per_dilation)
+    i = 0
+    while remainder > 0:
+        num_features_per_dilation[i] += 1
+        remainder -= 1
+        i = (i + 1) % len(num_features_per_dilation)
+    return dilations, num_features_per_dilation
+
+def _quantiles(n):
+    # low-discrepancy sequence (golden ratio)
+    return np.array([(_ * ((np.sqrt(5) + 1) / 2)) % 1 for _ in range(1, n + 1)], dtype = np.float32)
+
+@njit(fastmath = True)
+def _convolutions(_X, dilation, padding):
+    # convolution outputs of all 84 kernels are sums of 4 shifted copies of the series:
+    # C = C_alpha + C_gamma[i] + C_gamma[j] + C_gamma[k], with alpha = -1 and gamma = 3 (= 2 - alpha)
+    input_length = len(_X)
+    A = -_X
+    G = _X + _X + _X
+    C_alpha = np.zeros(input_length, dtype = _X.dtype)
+    C_alpha[:] = A
+    C_gamma = np.zeros((9, input_length), dtype = _X.dtype)
+    C_gamma[9 // 2] = G
+    start = dilation
+    end = input_length - padding
+    for gamma_index in range(9 // 2):
+        C_alpha[-end:] = C_alpha[-end:] + A[:end]
+        C_gamma[gamma_index, -end:] = G[:end]
+        end += dilation
+    for gamma_index in range(9 // 2 + 1, 9):
+        C_alpha[:-start] = C_alpha[:-start] + A[start:]
+        C_gamma[gamma_index, :-start] = G[start:]
+        start += dilation
+    return C_alpha, C_gamma
+
+@njit(fastmath = True)
+def _fit_biases(X, dilations, num_features_per_dilation, quantiles, indices, seed):
+    if seed >= 0: np.random.seed(seed)
+    num_examples, input_length = X.shape
+    num_kernels = len(indices)
+    num_features = num_kernels * np.sum(num_features_per_dilation)
+    biases = np.zeros(num_features, dtype = np.float32)
+    feature_index_start = 0
+    for dilation_index in range(len(dilations)):
+        dilation = dilations[dilation_index]
+        padding = ((9 - 1) * dilation) // 2
+        num_features_this_dilation = num_features_per_dilation[dilation_index]
+        for kernel_index in range(num_kernels):
+            feature_index_end = feature_index_start + num_features_this_dilation
+            # biases are quantiles of the convolution output of a random training example
+            C_alpha, C_gamma = _convolutions(X[np.random.randint(num_examples)], dilation, padding)
+            index_0, index_1, index_2 = indices[kernel_index]
+            C = C_alpha + C_gamma[index_0] + C_gamma[index_1] + C_gamma[index_2]
+            biases[feature_index_start:feature_index_end] = \
+            np.quantile(C, quantiles[feature_index_start:feature_index_end])
+            feature_index_start = feature_index_end
+    return biases
+
+def _to_2d(X):
+    X = np.asarray(X, dtype = np.float32)
+    if X.ndim == 3:
+        assert X.shape[1] == 1, 'minirocket is univariate: X should have a single channel'
+        X = X[:, 0]
+    return X
+
+def fit_minirocket(X, num_features=10000, max_dilations_per_kernel=32, seed=None):
+    # returns parameters (dilations, num_features_per_dilation, biases). num_features is rounded down to a multiple of 84
+    X = _to_2d(X)
+    dilations, num_features_per_dilation = _fit_dilations(X.shape[-1], num_features, max_dilations_per_kernel)
+    num_features_per_kernel = np.sum(num_features_per_dilation)
+    quantiles = _quantiles(len(_indices) * num_features_per_kernel)
+    biases = _fit_biases(X, dilations, num_features_per_dilation, quantiles, _indices, -1 if seed is None else seed)
+    return dilations, num_features_per_dilation, biases
+
+@njit(parallel = True, fastmath = True)
+def _apply_minirocket(X, dilations, num_features_per_dilation, biases, indices):
+    num_examples, input_length = X.shape
+    num_kernels = len(indices)
+    num_features = num_kernels * np.sum(num_features_per_dilation)
+    # initialise output
+    _X = np.zeros((num_examples, num_features), dtype = np.float32)
+    for i in prange(num_examples):
+        feature_index_start = 0
+        for dilation_index in range(len(dilations)):
+            # half of the features (alternating) are computed without padding
+            _padding0 = dilation_index % 2
+            dilation = dilations[dilation_index]
+            padding = ((9 - 1) * dilation) // 2
+            num_features_this_dilation = num_features_per_dilation[dilation_index]
+            C_alpha, C_gamma = _convolutions(X[i], dilation, padding)
+            for kernel_index in range(num_kernels):
+                feature_index_end = feature_index_start + num_features_this_dilation
+                _padding1 = (_padding0 + kernel_index) % 2
+                index_0, index_1, index_2 = indices[kernel_index]
+                C = C_alpha + C_gamma[index_0] + C_gamma[index_1] + C_gamma[index_2]
+                if _padding1 == 1 and padding > 0: C = C[padding:-padding]
+                for feature_count in range(num_features_this_dilation):
+                    bias = biases[feature_index_start + feature_count]
+                    _ppv = 0 # "proportion of positive values"
+                    for t in range(len(C)):
+                        if C[t] > bias: _ppv += 1
+                    _X[i, feature_index_start + feature_count] = _ppv / len(C)
+                feature_index_start = feature_index_end
+    return _X
+
+def apply_minirocket(X, parameters):
+    dilations, num_features_per_dilation, biases = parameters
+    return _apply_minirocket(_to_2d(X), dilations, num_features_per_dilation, biases, _indices)
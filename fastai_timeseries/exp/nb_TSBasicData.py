@@ -9,9 +9,13 @@ from fastai.core import *
 try:
     from exp.nb_TSUtilities import *
     from exp.nb_TSDatasets import *
+    from exp.rocket_functions import to_ragged
 except ImportError:
     from .nb_TSUtilities import *
     from .nb_TSDatasets import *
+    from .rocket_functions import to_ragged
+
+from torch.utils.data.sampler import Sampler
 
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
@@ -79,6 +83,7 @@ class TSDataBunch(DataBunch):
             self.stats = None
             return self
         assert scale_type in ['normalize', 'standardize', 'robustscale'], print('Select a correct type', scale_type)
+        if isinstance(self.train_ds.x, (MemmapTSList, RaggedTSList)): return self._scale_lazy()
 
         train = self.train_ds.x.items.astype(float)
         valid = self.valid_ds.x.items.astype(float)
@@ -175,6 +180,32 @@ class TSDataBunch(DataBunch):
                 if self.test_ds is not None:  self.test_ds.x.items = (test - train_median) / train_scale
                 return self
 
+    def _scale_lazy(self):
+        # MemmapTSList/ RaggedTSList: items are scaled when they are read (train statistics of MemmapTSLists are
+        # computed in chunks)
+        if self.scale_by_channel and self.scale_by_sample: axis = -1
+        elif self.scale_by_channel: axis = (0, 2)
+        elif self.scale_by_sample: axis = (1, 2)
+        else: axis = None
+        dss = [ds for ds in [self.train_ds, self.valid_ds, self.test_ds] if ds is not None]
+        assert all(isinstance(ds.x, self.train_ds.x.__class__) for ds in dss), \
+            f'all datasets should be {self.train_ds.x.__class__.__name__}s'
+        if self.scale_by_sample:
+            self.stats = None
+            for ds in dss: ds.x.scaler, ds.x.sample_scaler = None, (self.scale_type, axis, self.scale_range)
+        else:
+            self.stats = self.train_ds.x.scale_stats(self.scale_type, axis)
+            for ds in dss:
+                ds.x.scaler = ts_scale_params(self.stats, self.scale_type, self.scale_range)
+                ds.x.sample_scaler = None
+        return self
+
+    def chunked_shuffle(self, chunk_size=1024, buffer_chunks=4):
+        "Replaces the random order of the train dataloader with a `ChunkedShuffleSampler`"
+        sampler = ChunkedShuffleSampler(self.train_ds, chunk_size=chunk_size, buffer_chunks=buffer_chunks)
+        self.train_dl = self.train_dl.new(shuffle=False, sampler=sampler)
+        return self
+
     @property
     def cw(self)->None: return self._get_cw(self.train_dl)
 
@@ -293,6 +324,282 @@ class TimeSeriesList(ItemList):
 class TSList(TimeSeriesList): pass
 
 
+def ts_scale_stats(X, scale_type='standardize', axis=None):
+    "Statistics used by `TSDataBunch.scale` (min/ max, mean/ std or median/ iqr) of X along axis (keepdims)"
+    if scale_type == 'normalize':
+        return np.nanmin(X, axis=axis, keepdims=True), np.nanmax(X, axis=axis, keepdims=True)
+    elif scale_type == 'standardize':
+        return np.nanmean(X, axis=axis, keepdims=True), np.nanstd(X, axis=axis, keepdims=True) + 1e-8
+    elif scale_type == 'robustscale':
+        perc_25, perc_75 = np.nanpercentile(X, [25, 75], axis=axis, keepdims=True)
+        return np.nanmedian(X, axis=axis, keepdims=True), perc_75 - perc_25
+
+
+def ts_scale_params(stats, scale_type='standardize', scale_range=(-1, 1)):
+    "(a, b) such that X * a + b is X scaled with stats (see `ts_scale_stats`)"
+    if scale_type == 'normalize':
+        a = (scale_range[1] - scale_range[0]) / (stats[1] - stats[0])
+        return a.astype(np.float32), (scale_range[0] - stats[0] * a).astype(np.float32)
+    return (1 / stats[1]).astype(np.float32), (-stats[0] / stats[1]).astype(np.float32)
+
+
+def ts_scale(X, scaler=None, sample_scaler=None):
+    "Scales X (n_samples, channels, seq_len) with scaler (a, b) or by sample with sample_scaler (scale_type, axis, range)"
+    if scaler is not None: X = X * scaler[0] + scaler[1]
+    elif sample_scaler is not None:
+        scale_type, axis, scale_range = sample_scaler
+        a, b = ts_scale_params(ts_scale_stats(X, scale_type, axis), scale_type, scale_range)
+        X = X * a + b
+    return X.astype(np.float32, copy=False)
+
+
+class TSShards():
+    "Directory of .npy files of (n_i, channels, seq_len) samples, memory mapped and indexed as a single array"
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = Path(path)
+        self.shards = [np.load(fname, mmap_mode=mmap_mode) for fname in sorted(self.path.glob('*.npy'))]
+        assert self.shards, f'no .npy files in {self.path}'
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+        self.shape = (int(self.offsets[-1]),) + self.shards[0].shape[1:]
+        self.dtype, self.ndim = self.shards[0].dtype, self.shards[0].ndim
+
+    def __len__(self): return self.shape[0]
+
+    def __getitem__(self, idxs):
+        if isinstance(idxs, Integral):
+            if idxs < 0: idxs += len(self)
+            shard = np.searchsorted(self.offsets, idxs, side='right') - 1
+            return self.shards[shard][idxs - self.offsets[shard]]
+        idxs = np.asarray(range(len(self))[idxs] if isinstance(idxs, slice) else idxs)
+        idxs = np.where(idxs < 0, idxs + len(self), idxs)
+        out = np.empty((len(idxs),) + self.shape[1:], dtype=self.dtype)
+        shards = np.searchsorted(self.offsets, idxs, side='right') - 1
+        for shard in np.unique(shards):
+            m = shards == shard
+            out[m] = self.shards[shard][idxs[m] - self.offsets[shard]]
+        return out
+
+
+class MemmapTSList(TSList):
+    '''`TSList` for datasets that don't fit in memory.
+
+    items: (n_samples, channels, seq_len) (or (n_samples, seq_len)) array that is only read when items are accessed:
+        a np.memmap, a .npy file name (opened with mmap_mode='r') or a directory of .npy shards (`TSShards`).
+    Subsets (for example split_by_idx) only keep the index of their samples, and scaling (`TSDataBunch.scale`) is
+    applied when items are read. `get_batch` reads a batch of samples in storage order. Use
+    `TSDataBunch.chunked_shuffle` to read the train set in contiguous chunks.
+    '''
+
+    def __init__(self, items, *args, mask=None, tfms=None, idxs=None, scaler=None, sample_scaler=None, **kwargs):
+        if isinstance(items, (str, Path)):
+            items = TSShards(items) if os.path.isdir(items) else np.load(items, mmap_mode='r')
+        # ItemList would convert items that are not np.ndarrays (TSShards) to an object array
+        super(TimeSeriesList, self).__init__(items if isinstance(items, np.ndarray) else np.empty(0), *args, **kwargs)
+        self.items = items
+        self.tfms, self.mask, self.idxs = tfms, mask, idxs
+        self.scaler, self.sample_scaler = scaler, sample_scaler
+        self.copy_new += ['tfms', 'scaler', 'sample_scaler']
+
+    def __len__(self): return len(self.items) if self.idxs is None else len(self.idxs)
+
+    def _rows(self, idxs):
+        # rows of items of samples idxs (a slice, int or bool array)
+        if isinstance(idxs, slice):
+            return np.asarray(range(len(self.items))[idxs]) if self.idxs is None else self.idxs[idxs]
+        idxs = np.asarray(idxs)
+        if idxs.dtype == bool: idxs = np.nonzero(idxs)[0]
+        return idxs if self.idxs is None else self.idxs[idxs]
+
+    def __getitem__(self, idxs):
+        idxs = try_int(idxs)
+        if isinstance(idxs, Integral): return self.get(idxs)
+        return self.new(self.items, idxs=self._rows(idxs), inner_df=index_row(self.inner_df, idxs))
+
+    def get_batch(self, idxs, scale=True):
+        "(len(idxs), channels, seq_len) float32 tensor of items idxs (read in storage order)"
+        rows = self._rows(idxs)
+        order = np.argsort(rows, kind='stable')
+        X = np.empty((len(rows),) + self.items.shape[1:], dtype=np.float32)
+        X[order] = self.items[rows[order]]
+        if X.ndim == 2: X = X[:, None]
+        return torch.from_numpy(ts_scale(X, self.scaler, self.sample_scaler) if scale else X)
+
+    def get(self, i):
+        item = np.array(self.items[i if self.idxs is None else self.idxs[i]], dtype=np.float32)
+        item = ts_scale(item.reshape(1, -1, item.shape[-1]), self.scaler, self.sample_scaler)[0]
+        if self.mask is None: return TSItem(To2dTensor(item))
+        else: return[TSItem(To2dTensor(item[m])) for m in self.mask]
+
+    def scale_stats(self, scale_type='standardize', axis=None, chunksize=None):
+        '''`ts_scale_stats` of all samples (axis None or (0, 2)), read chunksize samples at a time. robustscale
+        percentiles are computed on a random sample of chunksize samples.'''
+        chunksize = chunksize or max(1, 2**24 // int(np.prod(self.items.shape[1:])))
+        if scale_type == 'robustscale':
+            idxs = np.sort(np.random.choice(len(self), min(len(self), chunksize), replace=False))
+            return ts_scale_stats(self.get_batch(idxs, scale=False).numpy().astype(float), scale_type, axis)
+        stats = []
+        for start in range(0, len(self), chunksize):
+            X = self.get_batch(slice(start, start + chunksize), scale=False).numpy().astype(float)
+            if scale_type == 'normalize': stats.append(ts_scale_stats(X, scale_type, axis))
+            else: stats.append((np.sum(~np.isnan(X), axis=axis, keepdims=True), np.nanmean(X, axis=axis, keepdims=True),
+                                np.nanvar(X, axis=axis, keepdims=True)))
+        if scale_type == 'normalize':
+            return (np.nanmin(np.concatenate([s[0] for s in stats]), axis=0, keepdims=True),
+                    np.nanmax(np.concatenate([s[1] for s in stats]), axis=0, keepdims=True))
+        # means and variances of the chunks are combined with their number of (non nan) values
+        n = np.sum([s[0] for s in stats], axis=0)
+        mean = np.nansum([count * m for count, m, _ in stats], axis=0) / n
+        var = np.nansum([count * (v + (m - mean) ** 2) for count, m, v in stats], axis=0) / n
+        return mean, np.sqrt(var) + 1e-8
+
+
+class ChunkedShuffleSampler(Sampler):
+    '''Random order of the samples of data_source that reads them in contiguous chunks: the order of the chunks of
+    chunk_size consecutive samples is shuffled, and the samples of every buffer_chunks chunks are shuffled together.
+    Each chunk of a `MemmapTSList` is read from disk (or the page cache) once per epoch.'''
+
+    def __init__(self, data_source, chunk_size=1024, buffer_chunks=4):
+        self.data_source, self.chunk_size, self.buffer_chunks = data_source, chunk_size, buffer_chunks
+
+    def __len__(self): return len(self.data_source)
+
+    def __iter__(self):
+        n = len(self.data_source)
+        chunks = np.random.permutation(-(-n // self.chunk_size))
+        for start in range(0, len(chunks), self.buffer_chunks):
+            idxs = np.concatenate([np.arange(chunk * self.chunk_size, min((chunk + 1) * self.chunk_size, n))
+                                   for chunk in chunks[start:start + self.buffer_chunks]])
+            yield from np.random.permutation(idxs).tolist()
+
+
+def ts_ragged_collate(batch, mask=True, pad_value=0.):
+    '''Collates (TSItem, y) samples of different lengths: items are padded (at the end) to the longest item of the
+    batch. If mask, x is returned with a (bs, seq_len) bool mask (True for values, False for padding) as (x, mask).'''
+    xs, ys = zip(*to_data(batch))
+    lengths = torch.tensor([x.shape[-1] for x in xs])
+    x = torch.full((len(xs), xs[0].shape[-2], int(lengths.max())), pad_value, dtype=xs[0].dtype)
+    for i, xi in enumerate(xs): x[i, :, :xi.shape[-1]] = xi
+    y = torch.utils.data.dataloader.default_collate(list(ys))
+    if not mask: return x, y
+    return (x, torch.arange(x.shape[-1])[None] < lengths[:, None]), y
+
+
+class BucketBatchSampler(Sampler):
+    '''Batches of samples of similar length. Samples are shuffled and split in buckets of bucket_size batches, each
+    bucket is sorted by length and cut into batches, and the order of the batches is shuffled.
+    With shuffle=False, batches are consecutive samples (predictions keep the order of the dataset).'''
+
+    def __init__(self, lengths, bs=64, shuffle=True, drop_last=False, bucket_size=100):
+        self.lengths, self.bs, self.shuffle = np.asarray(lengths), bs, shuffle
+        self.drop_last, self.bucket_size = drop_last, bucket_size
+
+    def __len__(self): return len(self.lengths) // self.bs if self.drop_last else -(-len(self.lengths) // self.bs)
+
+    def __iter__(self):
+        if not self.shuffle:
+            batches = [np.arange(start, min(start + self.bs, len(self.lengths)))
+                       for start in range(0, len(self.lengths), self.bs)]
+        else:
+            idxs, size, batches = np.random.permutation(len(self.lengths)), self.bs * self.bucket_size, []
+            for start in range(0, len(idxs), size):
+                bucket = idxs[start:start + size]
+                bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+                batches += [bucket[i:i + self.bs] for i in range(0, len(bucket), self.bs)]
+            batches = [batches[i] for i in np.random.permutation(len(batches))]
+        for batch in batches:
+            if len(batch) == self.bs or not self.drop_last: yield batch.tolist()
+
+
+def padding_stats(lengths, bs=64, bucket_size=100):
+    '''Fraction of padded values (wasted compute) in an epoch of batches of bs samples of lengths: padded to the longest
+    sample of the dataset, to the longest of each random batch and with `BucketBatchSampler`'''
+    lengths = np.asarray(lengths)
+    def _padding(batches): return 1 - lengths.sum() / sum(lengths[b].max() * len(b) for b in batches)
+    random_batches = np.array_split(np.random.permutation(len(lengths)), -(-len(lengths) // bs))
+    bucket_batches = [np.array(b) for b in BucketBatchSampler(lengths, bs, bucket_size=bucket_size)]
+    return {'dataset': 1 - lengths.mean() / lengths.max(), 'random_batches': _padding(random_batches),
+            'bucketed_batches': _padding(bucket_batches)}
+
+
+class RaggedTSDataBunch(TSDataBunch):
+    "`TSDataBunch` of `RaggedTSList`s: batches of samples of similar length (`BucketBatchSampler`) padded by batch"
+
+    @classmethod
+    def create(cls, train_ds, valid_ds, test_ds=None, path='.', bs=64, val_bs=None, num_workers=defaults.cpus,
+               dl_tfms=None, device=None, collate_fn=data_collate, no_check=False, mask=True, bucket_size=100,
+               **dl_kwargs):
+        if collate_fn is data_collate: collate_fn = partial(ts_ragged_collate, mask=mask)
+        datasets = cls._init_ds(train_ds, valid_ds, test_ds)
+        val_bs = ifnone(val_bs, bs)
+        dls = [DataLoader(d, batch_sampler=BucketBatchSampler(d.x.lengths, b, shuffle=s, drop_last=s,
+                                                              bucket_size=bucket_size),
+                          num_workers=num_workers, **dl_kwargs)
+               for d, b, s in zip(datasets, (bs, val_bs, val_bs, val_bs), (True, False, False, False)) if d is not None]
+        return cls(*dls, path=path, device=device, dl_tfms=dl_tfms, collate_fn=collate_fn, no_check=no_check)
+
+
+class RaggedTSPreProcessor(TSPreProcessor):
+
+    def process(self, ds: ItemList):
+        ds.features, ds.seq_len = self.ds.values.shape[0], int(self.ds.lengths.max())
+        ds.f = ds.features
+        ds.s = ds.seq_len
+
+
+class RaggedTSList(TSList):
+    '''`TSList` of series of different lengths.
+
+    items: list of (seq_len_i,) or (channels, seq_len_i) arrays (see also `from_padded` and `from_ragged`).
+    The series are stored concatenated in values (channels, total length), with sample i in
+    values[:, offsets[i]:offsets[i + 1]], and items is the index of each sample. Its `databunch` (`RaggedTSDataBunch`)
+    returns batches of samples of similar length, padded to the longest one in the batch, and ((x, mask), y) batches
+    (mask=False in databunch for models without mask support).
+    '''
+    _bunch = RaggedTSDataBunch
+    _processor = RaggedTSPreProcessor
+
+    def __init__(self, items, *args, values=None, offsets=None, mask=None, tfms=None, scaler=None, sample_scaler=None,
+                 **kwargs):
+        if values is None:
+            samples = [np.asarray(item, dtype=np.float32) for item in items]
+            samples = [sample[None] if sample.ndim == 1 else sample for sample in samples]
+            values = np.concatenate(samples, axis=-1)
+            offsets = np.cumsum([0] + [sample.shape[-1] for sample in samples])
+            items = np.arange(len(samples))
+        super(TimeSeriesList, self).__init__(items, *args, **kwargs)
+        self.values, self.offsets = values, offsets
+        self.tfms, self.mask, self.scaler, self.sample_scaler = tfms, mask, scaler, sample_scaler
+        self.copy_new += ['tfms', 'values', 'offsets', 'scaler', 'sample_scaler']
+
+    @classmethod
+    def from_ragged(cls, values, offsets, **kwargs):
+        "From values (channels, total length) (or (total length,)) and the offsets of the samples"
+        values = np.asarray(values, dtype=np.float32)
+        return cls(np.arange(len(offsets) - 1), values=values[None] if values.ndim == 1 else values,
+                   offsets=np.asarray(offsets), **kwargs)
+
+    @classmethod
+    def from_padded(cls, X, **kwargs):
+        "From a (n_samples, [channels,] seq_len) array of series padded at the end with nan (all nan samples are empty)"
+        return cls.from_ragged(*to_ragged(To3dArray(X)), **kwargs)
+
+    @property
+    def lengths(self): return np.diff(self.offsets)[self.items]
+
+    def get(self, i):
+        j = self.items[i]
+        item = np.array(self.values[None, :, self.offsets[j]:self.offsets[j + 1]], dtype=np.float32)
+        item = ts_scale(item, self.scaler, self.sample_scaler)[0]
+        if self.mask is None: return TSItem(To2dTensor(item))
+        else: return[TSItem(To2dTensor(item[m])) for m in self.mask]
+
+    def scale_stats(self, scale_type='standardize', axis=None):
+        "`ts_scale_stats` of all samples (axis None or (0, 2))"
+        values = np.concatenate([self.values[:, self.offsets[j]:self.offsets[j + 1]] for j in self.items], axis=-1)
+        return ts_scale_stats(values[None].astype(float), scale_type, axis)
+
+
 
 class MixedTimeSeriesList(ItemList):
     "`ItemList` suitable for time series"
@@ -1,6 +1,7 @@
 #AUTOGENERATED! DO NOT EDIT! file to edit: ./TSDatasets.ipynb (unless otherwise specified)
 from pathlib import Path
 import os
+import json
 import numpy as np
 import pandas as pd
 from scipy.io import arff
@@ -18,6 +19,7 @@ import tempfile
 try: from urllib import urlretrieve
 except ImportError: from urllib.request import urlretrieve
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pyunpack import Archive
 
 
@@ -117,7 +119,135 @@ def get_UCR_multivariate_list():
     ])
 
 
-def get_UCR_univariate(sel_dataset, parent_dir='data/UCR', verbose=False, drop_na=False, check=True):
+# ARFF reader for the layout used by the UCR/ UEA archive: numeric attributes (or a single relational attribute with
+# numeric attributes for multivariate series) followed by a nominal class attribute. The @data section is parsed in
+# blocks of lines straight into a preallocated array, and labels are encoded as they are read, so peak memory is about
+# one copy of the data (loadarff + DataFrame make several).
+def _read_arff_header(f):
+    # (number of values per channel, relational) of the attributes, with f positioned after @data
+    n_values, relational = 0, False
+    for line in f:
+        words = line.strip().lower().split()
+        if not words or words[0].startswith(b'%'): continue
+        if words[0] == b'@data': return n_values, relational
+        if words[0] != b'@attribute': continue
+        if words[-1] == b'relational': relational = True
+        elif b'{' not in line: n_values += 1
+    raise ValueError('@data section not found')
+
+
+def _encode_labels(labels, mapping):
+    # class index of each label, with new labels added to mapping in order of appearance
+    uniques, idxs, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    for label in uniques[np.argsort(idxs)]: mapping.setdefault(label, len(mapping))
+    return np.array([mapping[label] for label in uniques], dtype=np.int64)[inverse.ravel()]
+
+
+def read_arff(fname, classes=None, dtype=np.float32, block_size=2**22, out=None):
+    '''Reads a UCR/ UEA ARFF file.
+
+    Returns X, y, classes: X is (n_samples, seq_len) (or (n_samples, n_channels, seq_len) for relational files) with
+    missing values as nan, y the class index of each sample and classes the label of each index. Labels not in classes
+    (for example the train classes when reading a test set) are added in order of appearance.
+    block_size: approximate size (bytes) of the lines parsed at once.
+    out: (n_samples, seq_len) array (or view, like a channel of a 3d array) X is read into (not relational files).
+    '''
+    with open(fname, 'rb') as f:
+        n_values, relational = _read_arff_header(f)
+        start = f.tell()
+        n_samples = sum(1 for line in map(bytes.strip, f) if line and not line.startswith(b'%'))
+        f.seek(start)
+        mapping = {label: i for i, label in enumerate([] if classes is None else classes)}
+        y = np.empty(n_samples, dtype=np.int64)
+        X = None
+        i = 0
+        while True:
+            lines = f.readlines(block_size)
+            if not lines: break
+            # a block may only hold blank lines or comments (for example the blank lines at the end of the file)
+            lines = [line for line in map(bytes.strip, lines) if line and not line.startswith(b'%')]
+            if not lines: continue
+            values, _, labels = zip(*[line.rpartition(b',') for line in lines])
+            y[i:i + len(labels)] = _encode_labels([l.strip(b' \'"').decode() for l in labels], mapping)
+            if relational:
+                # each sample is a quoted string with the channels separated by \n
+                values = [v.strip(b' \'"').split(b'\\n') for v in values]
+                if X is None: X = np.full((n_samples, len(values[0]), n_values), np.nan, dtype=dtype)
+            elif X is None: X = np.empty((n_samples, n_values), dtype=dtype) if out is None else out
+            block = X[i:i + len(values)]
+            text = b','.join(b','.join(v) for v in values) if relational else b','.join(values)
+            if b'?' in text: text = text.replace(b'?', b'nan')
+            arr = np.fromstring(text, dtype=dtype, sep=',')
+            if arr.size == block.size: block[:] = arr.reshape(block.shape)
+            elif relational:
+                # series of different lengths (padded with nan)
+                for sample, channels in zip(block, values):
+                    for channel, v in zip(sample, channels):
+                        v = np.fromstring(v.replace(b'?', b'nan'), dtype=dtype, sep=',')
+                        channel[:len(v)] = v
+            else: raise ValueError(f'{fname}: expected {n_values} values per sample')
+            i += len(values)
+    return X, y, [str(label) for label in mapping]
+
+
+def read_arff_dimensions(fnames, classes=None, n_workers=1):
+    '''Reads one ARFF file per dimension (...DimensionN_TRAIN.arff) into a (n_samples, n_channels, seq_len) array.
+
+    Returns X, y, classes as read_arff (y and classes of the first file). Each file is read straight into its channel
+    of X. n_workers: threads reading the files (None: one per CPU).
+    '''
+    X, y, classes = read_arff(fnames[0], classes=classes)
+    out = np.empty((len(X), len(fnames), X.shape[-1]), dtype=X.dtype)
+    out[:, 0] = X
+    del X
+    def _read(i): read_arff(fnames[i], classes=classes, out=out[:, i])
+    n_workers = min(n_workers or os.cpu_count(), len(fnames) - 1)
+    if n_workers <= 1:
+        for i in range(1, len(fnames)): _read(i)
+    else:
+        with ThreadPoolExecutor(n_workers) as executor: list(executor.map(_read, range(1, len(fnames))))
+    return out, y, classes
+
+
+# Parsed datasets are cached as .npy files (X_train, y_train, X_test, y_test and classes, the label of each class
+# index) in a 'cache' directory next to the ARFF files. Cached arrays are loaded as copy-on-write memory maps
+# (mmap_mode='c'): like freshly parsed arrays they can be modified in place, but changes stay in memory and are never
+# written back to the cache. The size and modification time of the source files (and the loading options) are stored
+# with them: if any of them changes, the dataset is parsed again.
+_UCR_cache_names = ['X_train', 'y_train', 'X_test', 'y_test', 'classes']
+
+
+def _UCR_cache_key(fnames, **kwargs):
+    key = {os.path.basename(fname): [os.stat(fname).st_size, os.stat(fname).st_mtime_ns] for fname in fnames}
+    key.update(kwargs)
+    return key
+
+
+def load_UCR_cache(tgt_dir, key, mmap_mode='c'):
+    "Cached (X_train, y_train, X_test, y_test, classes) of a dataset, or None if the cache is missing or stale"
+    cache_dir = Path(tgt_dir) / 'cache'
+    try:
+        with open(cache_dir / 'key.json') as f:
+            if json.load(f) != key: return None
+        return tuple(np.load(cache_dir / f'{name}.npy', mmap_mode=mmap_mode) for name in _UCR_cache_names)
+    except (OSError, ValueError): return None
+
+
+def save_UCR_cache(tgt_dir, key, X_train, y_train, X_test, y_test, classes):
+    cache_dir = Path(tgt_dir) / 'cache'
+    os.makedirs(cache_dir, exist_ok=True)
+    # the key is written last (and removed first) so that an interrupted write never leaves a valid looking cache.
+    # Arrays are written to temporary files that replace the old ones: arrays loaded earlier are memory maps of the old
+    # files, which must never be overwritten in place
+    if os.path.isfile(cache_dir / 'key.json'): os.remove(cache_dir / 'key.json')
+    classes = np.array([c.decode() if isinstance(c, bytes) else str(c) for c in classes])
+    for name, arr in zip(_UCR_cache_names, [X_train, y_train, X_test, y_test, classes]):
+        np.save(cache_dir / f'{name}.tmp.npy', arr)
+        os.replace(cache_dir / f'{name}.tmp.npy', cache_dir / f'{name}.npy')
+    with open(cache_dir / 'key.json', 'w') as f: json.dump(key, f)
+
+
+def get_UCR_univariate(sel_dataset, parent_dir='data/UCR', verbose=False, drop_na=False, check=True, cache=True):
     if check and sel_dataset not in get_UCR_univariate_list():
         print('This dataset does not exist. Please select one from this list:')
         print(get_UCR_univariate_list())
@@ -132,24 +262,24 @@ def get_UCR_univariate(sel_dataset, parent_dir='data/UCR', verbose=False, drop_n
     if verbose: print('...data downloaded and decompressed')
     fname_train = sel_dataset + "_TRAIN.arff"
     fname_test = sel_dataset + "_TEST.arff"
-
-    train_df = pd.DataFrame(arff.loadarff(os.path.join(tgt_dir, fname_train))[0])
-    test_df = pd.DataFrame(arff.loadarff(os.path.join(tgt_dir, fname_test))[0])
-    unique_cats = train_df.iloc[:, -1].unique()
-    mapping = dict(zip(unique_cats, np.arange(len(unique_cats))))
-    train_df = train_df.replace({train_df.columns.values[-1]: mapping})
-    test_df = test_df.replace({test_df.columns.values[-1]: mapping})
+    if cache:
+        key = _UCR_cache_key([os.path.join(tgt_dir, fname_train), os.path.join(tgt_dir, fname_test)], drop_na=drop_na,
+                             dtype='float32')
+        # cached arrays are copy-on-write memory maps: in place changes don't modify the cache
+        cached = load_UCR_cache(tgt_dir, key)
+        if cached is not None:
+            if verbose: print('...data loaded from cache')
+            return cached[:4]
+
+    X_train, y_train, classes = read_arff(os.path.join(tgt_dir, fname_train))
+    X_test, y_test, classes = read_arff(os.path.join(tgt_dir, fname_test), classes=classes)
     if drop_na:
-        train_df.dropna(axis=1, inplace=True)
-        test_df.dropna(axis=1, inplace=True)
-
-    X_train = train_df.iloc[:, :-1].values.astype(np.float32)
-    X_test = test_df.iloc[:, :-1].values.astype(np.float32)
-    y_train = train_df.iloc[:, -1].values.astype(int)
-    y_test = test_df.iloc[:, -1].values.astype(int)
+        X_train = X_train[:, ~np.isnan(X_train).any(axis=0)]
+        X_test = X_test[:, ~np.isnan(X_test).any(axis=0)]
 
     X_train = To3dArray(X_train)
     X_test = To3dArray(X_test)
+    if cache: save_UCR_cache(tgt_dir, key, X_train, y_train, X_test, y_test, classes)
 
     if verbose:
         print('Successfully extracted dataset\n')
@@ -161,7 +291,7 @@ def get_UCR_univariate(sel_dataset, parent_dir='data/UCR', verbose=False, drop_n
 
 
 
-def get_UCR_multivariate(sel_dataset, parent_dir='data/UCR', verbose=False, check=True):
+def get_UCR_multivariate(sel_dataset, parent_dir='data/UCR', verbose=False, check=True, cache=True, n_workers=1):
     if sel_dataset.lower() == 'mphoneme': sel_dataset = 'Phoneme'
     if check and sel_dataset not in get_UCR_multivariate_list():
         print('This dataset does not exist. Please select one from this list:')
@@ -176,39 +306,29 @@ def get_UCR_multivariate(sel_dataset, parent_dir='data/UCR', verbose=False, chec
         decompress_from_url(
             src_website + sel_dataset + '.zip', target_dir=tgt_dir, verbose=verbose)
     if verbose: print('...data downloaded and decompressed')
+    # one file per dimension (...DimensionN_TRAIN.arff) or, if there are none, a single relational file
+    fnames = sorted(str(f) for f in Path(tgt_dir).glob(f'{sel_dataset}Dimension*_T*.arff'))
+    if not fnames: fnames = [os.path.join(tgt_dir, f'{sel_dataset}_{split}.arff') for split in ['TRAIN', 'TEST']]
+    if cache:
+        key = _UCR_cache_key(fnames, dtype='float32')
+        # cached arrays are copy-on-write memory maps: in place changes don't modify the cache
+        cached = load_UCR_cache(tgt_dir, key)
+        if cached is not None:
+            if verbose: print('...data loaded from cache')
+            return cached[:4]
     if verbose: print('Extracting data...')
-    X_train_ = []
-    X_test_ = []
-    for i in range(10000):
-        if not os.path.isfile(
-                f'{parent_dir}/{sel_dataset}/{sel_dataset}Dimension'
-                + str(i + 1) + '_TRAIN.arff'):
-            break
-        train_df = pd.DataFrame(
-            arff.loadarff(
-                f'{parent_dir}/{sel_dataset}/{sel_dataset}Dimension'
-                + str(i + 1) + '_TRAIN.arff')[0])
-        unique_cats = train_df.iloc[:, -1].unique()
-        mapping = dict(zip(unique_cats, np.arange(len(unique_cats))))
-        train_df = train_df.replace({train_df.columns.values[-1]: mapping})
-        test_df = pd.DataFrame(
-            arff.loadarff(
-                f'{parent_dir}/{sel_dataset}/{sel_dataset}Dimension'
-                + str(i + 1) + '_TEST.arff')[0])
-        test_df = test_df.replace({test_df.columns.values[-1]: mapping})
-        X_train_.append(train_df.iloc[:, :-1].values)
-        X_test_.append(test_df.iloc[:, :-1].values)
-
+    if not os.path.isfile(f'{parent_dir}/{sel_dataset}/{sel_dataset}Dimension1_TRAIN.arff'):
+        X_train, y_train, classes = read_arff(f'{parent_dir}/{sel_dataset}/{sel_dataset}_TRAIN.arff')
+        X_test, y_test, classes = read_arff(f'{parent_dir}/{sel_dataset}/{sel_dataset}_TEST.arff', classes=classes)
+    else:
+        n_dims = 0
+        while os.path.isfile(f'{parent_dir}/{sel_dataset}/{sel_dataset}Dimension{n_dims + 1}_TRAIN.arff'): n_dims += 1
+        dims = [f'{parent_dir}/{sel_dataset}/{sel_dataset}Dimension{i + 1}' for i in range(n_dims)]
+        X_train, y_train, classes = read_arff_dimensions([dim + '_TRAIN.arff' for dim in dims], n_workers=n_workers)
+        X_test, y_test, classes = read_arff_dimensions([dim + '_TEST.arff' for dim in dims], classes=classes,
+                                                       n_workers=n_workers)
     if verbose: print('...extraction complete')
-    X_train = np.stack(X_train_, axis=-1)
-    X_test = np.stack(X_test_, axis=-1)
-
-    # In this case we need to rearrange the arrays ()
-    X_train = np.transpose(X_train, (0, 2, 1))
-    X_test = np.transpose(X_test, (0, 2, 1))
-
-    y_train = np.array([int(float(x)) for x in train_df.iloc[:, -1]])
-    y_test = np.array([int(float(x)) for x in test_df.iloc[:, -1]])
+    if cache: save_UCR_cache(tgt_dir, key, X_train, y_train, X_test, y_test, classes)
 
     if verbose:
         print('Successfully extracted dataset\n')
@@ -219,11 +339,11 @@ def get_UCR_multivariate(sel_dataset, parent_dir='data/UCR', verbose=False, chec
     return X_train, y_train, X_test, y_test
 
 
-def get_UCR_data(dsid, parent_dir='data/UCR', verbose=False, check=True):
+def get_UCR_data(dsid, parent_dir='data/UCR', verbose=False, check=True, cache=True):
     if dsid in get_UCR_univariate_list():
-        return get_UCR_univariate(dsid, verbose=verbose, check=check)
+        return get_UCR_univariate(dsid, parent_dir=parent_dir, verbose=verbose, check=check, cache=cache)
     elif dsid in get_UCR_multivariate_list():
-        return get_UCR_multivariate(dsid, verbose=verbose, check=check)
+        return get_UCR_multivariate(dsid, parent_dir=parent_dir, verbose=verbose, check=check, cache=cache)
     else:
         print(f'This {dsid} dataset does not exist. Please select one from these lists:')
         print('\nunivariate datasets')
@@ -258,4 +378,4 @@ def get_translation_invariance_data(n_samples, seq_len, seed):
     X_test, y_test = create_seq_optimized(
         n_samples=n_samples, seq_len=seq_len, channels=True, seed=seed + 1)
     print(X_train.shape, y_train.shape, X_test.shape, y_test.shape, '\n')
-    return X_train, y_train, X_test, y_test
\ No newline at end of file
+    return X_train, y_train, X_test, y_test
@@ -0,0 +1,358 @@
+# Benchmarks and accuracy checks for the numba ROCKET implementation in rocket_functions (and for the packed
+# torch ROCKET in torchtimeseries.models). They are not imported by fastai_timeseries.
+# Use: from fastai_timeseries.exp.rocket_benchmarks import *
+
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from scipy.io import arff
+from numba import njit, prange
+
+try: from exp.rocket_functions import *
+except ImportError: from .rocket_functions import *
+
+
+def _timeit(func, *args, **kwargs):
+    start = time.time()
+    out = func(*args, **kwargs)
+    return out, time.time() - start
+
+
+def _ridge_score(X_train_tfm, y_train, X_valid_tfm, y_valid):
+    from sklearn.linear_model import RidgeClassifierCV
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    classifier = make_pipeline(StandardScaler(), RidgeClassifierCV(alphas=np.logspace(-3, 3, 7)))
+    classifier.fit(X_train_tfm, y_train)
+    return classifier.score(X_valid_tfm, y_valid)
+
+
+def _get_UCR_univariate(dsid, parent_dir='data/UCR'):
+    try: from exp.nb_TSDatasets import get_UCR_data
+    except ImportError: from .nb_TSDatasets import get_UCR_data
+    X_train, y_train, X_valid, y_valid = get_UCR_data(dsid, parent_dir=parent_dir)
+    X_train, X_valid = X_train[:, 0].astype(np.float64), X_valid[:, 0].astype(np.float64)
+    X_train = (X_train - X_train.mean(axis=1, keepdims=True)) / (X_train.std(axis=1, keepdims=True) + 1e-8)
+    X_valid = (X_valid - X_valid.mean(axis=1, keepdims=True)) / (X_valid.std(axis=1, keepdims=True) + 1e-8)
+    return X_train, y_train, X_valid, y_valid
+
+
+def check_dtype_parity(dsids=['Coffee', 'ECG200', 'GunPoint', 'OliveOil'], num_kernels=10000, parent_dir='data/UCR'):
+    "Ridge accuracy on UCR datasets using the same kernels with float64 and float32 features"
+    rows = []
+    for dsid in dsids:
+        X_train, y_train, X_valid, y_valid = _get_UCR_univariate(dsid, parent_dir=parent_dir)
+        kernels = generate_kernels(X_train.shape[-1], num_kernels)
+        row = {'dataset': dsid}
+        for dtype in [np.float64, np.float32]:
+            X_train_tfm = apply_kernels(X_train, kernels, dtype)
+            X_valid_tfm = apply_kernels(X_valid, kernels, dtype)
+            row[f'{np.dtype(dtype).name}_accuracy'] = _ridge_score(X_train_tfm, y_train, X_valid_tfm, y_valid)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def benchmark_dtype(n_samples=1000, seq_len=500, num_kernels=10000, seed=1):
+    "Transform time and memory (input + features) of apply_kernels with float64 and float32"
+    np.random.seed(seed)
+    X = np.random.randn(n_samples, seq_len).astype(np.float32)
+    kernels = generate_kernels(seq_len, num_kernels)
+    rows = []
+    for dtype in [np.float64, np.float32]:
+        apply_kernels(X[:2], kernels, dtype) # jit compilation
+        X_tfm, duration = _timeit(apply_kernels, X, kernels, dtype)
+        rows.append({'dtype': np.dtype(dtype).name, 'time (s)': duration,
+                     'memory (MB)': (X.size * np.dtype(dtype).itemsize + X_tfm.nbytes) / 2**20})
+    return pd.DataFrame(rows)
+
+
+@njit(parallel = True, fastmath = True)
+def _apply_kernels_per_kernel(X, weights, lengths, biases, dilations, paddings):
+    # previous apply_kernels: one apply_kernel call (and padded copy of the series) per kernel
+    num_examples = len(X)
+    num_kernels = len(weights)
+    _X = np.zeros((num_examples, num_kernels * 2), dtype = X.dtype)
+    for i in prange(num_examples):
+        for j in range(num_kernels):
+            _X[i, (j * 2):((j * 2) + 2)] = \
+            apply_kernel(X[i], weights[j][:lengths[j]], lengths[j], biases[j], dilations[j], paddings[j])
+    return _X
+
+
+def benchmark_padding(n_samples=100, seq_len=2000, num_kernels=10000, seed=1):
+    "apply_kernels (shared padding, kernels grouped by length and dilation) vs one padded copy per kernel"
+    np.random.seed(seed)
+    X = np.random.randn(n_samples, seq_len)
+    kernels = generate_kernels(seq_len, num_kernels)
+    apply_kernels(X[:2], kernels) # jit compilation
+    _apply_kernels_per_kernel(X[:2], *kernels)
+    X_tfm, duration = _timeit(apply_kernels, X, kernels)
+    X_tfm_ref, duration_ref = _timeit(_apply_kernels_per_kernel, X, *kernels)
+    return pd.DataFrame([{'method': 'per kernel padding', 'time (s)': duration_ref},
+                         {'method': 'shared padding', 'time (s)': duration,
+                          'max abs diff': np.abs(X_tfm - X_tfm_ref).max()}])
+
+
+def benchmark_parallel(n_samples=100, seq_len=1000, num_kernels=10000, max_workers=None, n_sample_tiles=1, seed=1):
+    '''Scaling of apply_kernels_parallel (kernel shards) from 1 to max_workers processes. Each pool is started and
+    warmed up (processes started, numba functions compiled) by an untimed call, and only a second call is timed'''
+    try: from exp.rocket_parallel import apply_kernels_parallel, rocket_pool
+    except ImportError: from .rocket_parallel import apply_kernels_parallel, rocket_pool
+    max_workers = max_workers or os.cpu_count()
+    np.random.seed(seed)
+    X = np.random.randn(n_samples, seq_len)
+    kernels = generate_kernels(seq_len, num_kernels, seed=seed)
+    X_tfm_ref = apply_kernels(X, kernels)
+    rows = []
+    for n_workers in range(1, max_workers + 1):
+        with rocket_pool(n_workers, dtypes=(X.dtype,)) as executor:
+            apply_kernels_parallel(X, kernels, n_sample_tiles=n_sample_tiles, executor=executor)
+            X_tfm, duration = _timeit(apply_kernels_parallel, X, kernels, n_sample_tiles=n_sample_tiles,
+                                      executor=executor)
+        rows.append({'n_workers': n_workers, 'time (s)': duration, 'max abs diff': np.abs(X_tfm - X_tfm_ref).max()})
+    df = pd.DataFrame(rows)
+    df['speedup'] = df['time (s)'].iloc[0] / df['time (s)']
+    return df
+
+
+_startup_script = '''
+import sys, time
+start = time.time()
+sys.path.insert(0, {path!r})
+import numpy as np
+import rocket_functions
+imported = time.time()
+X = np.random.randn({n_samples}, {seq_len})
+kernels = rocket_functions.generate_kernels({seq_len}, {num_kernels}, seed=0)
+rocket_functions.apply_kernels(X, kernels, dtype={dtype})
+first = time.time()
+rocket_functions.apply_kernels(X, kernels, dtype={dtype})
+print(imported - start, first - imported, time.time() - first)
+'''
+
+def benchmark_startup(n_samples=10, seq_len=500, num_kernels=1000, dtype='np.float64', cache_dir=None):
+    '''Startup latency of a fresh process (import, first call to generate_kernels + apply_kernels and second call)
+    with an empty numba cache (cold: everything is compiled) and with the cache written by the previous run (warm).
+    Both runs import rocket_functions under the same name, with ROCKET_NUMBA_CACHE=1.
+    cache_dir: NUMBA_CACHE_DIR used by both runs (default: a new temporary directory).
+    '''
+    import shutil, subprocess, sys
+    try: from exp import rocket_functions
+    except ImportError: from . import rocket_functions
+    path = os.path.dirname(os.path.abspath(rocket_functions.__file__))
+    tmp_dir = cache_dir or tempfile.mkdtemp(prefix='numba_cache_')
+    script = _startup_script.format(path=path, n_samples=n_samples, seq_len=seq_len, num_kernels=num_kernels, dtype=dtype)
+    rows = []
+    try:
+        for run in ['cold', 'warm']:
+            start = time.time()
+            env = {**os.environ, 'NUMBA_CACHE_DIR': tmp_dir, 'ROCKET_NUMBA_CACHE': '1'}
+            out = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                 check=True).stdout
+            total = time.time() - start
+            import_time, first_call, second_call = map(float, out.split())
+            rows.append({'run': run, 'import (s)': import_time, 'first call (s)': first_call,
+                         'second call (s)': second_call, 'process total (s)': total})
+    finally:
+        if cache_dir is None: shutil.rmtree(tmp_dir, ignore_errors=True)
+    return pd.DataFrame(rows).set_index('run')
+
+
+def benchmark_features(n_samples=100, seq_len=1000, num_kernels=10000, seed=1):
+    "Time of apply_kernels with the default features (ppv, max) and with each extra pooling feature (and all of them)"
+    np.random.seed(seed)
+    X = np.random.randn(n_samples, seq_len)
+    kernels = generate_kernels(seq_len, num_kernels, seed=seed)
+    extra = [f for f in pooling_features if f not in ['ppv', 'max']]
+    feature_sets = [['ppv', 'max']] + [['ppv', 'max', f] for f in extra] + [pooling_features]
+    apply_kernels(X[:1], kernels, features=pooling_features) # compilation
+    rows = []
+    for features in feature_sets:
+        _, duration = _timeit(apply_kernels, X, kernels, features=features)
+        rows.append({'features': ', '.join(features), 'time (s)': duration})
+    df = pd.DataFrame(rows)
+    df['overhead'] = df['time (s)'] / df['time (s)'].iloc[0] - 1
+    return df
+
+
+def benchmark_fft(seq_lens=[1000, 10000, 50000], n_samples=10, num_kernels=1000, num_channels=None, kss=[7, 9, 11],
+                  seed=1):
+    '''Time of the direct engine (apply_kernels(_multi)) and of apply_kernels_fft with method='fft' and 'auto' (cost
+    model), with the share of kernels the cost model runs with the FFT engine. num_channels: multivariate kernels.
+    '''
+    try: from exp.rocket_fft import apply_kernels_fft, bucket_costs
+    except ImportError: from .rocket_fft import apply_kernels_fft, bucket_costs
+    np.random.seed(seed)
+    rows = []
+    for seq_len in seq_lens:
+        if num_channels is None:
+            X = np.random.randn(n_samples, seq_len)
+            kernels, _apply_kernels = generate_kernels(seq_len, num_kernels, kss=kss, seed=seed), apply_kernels
+        else:
+            X = np.random.randn(n_samples, num_channels, seq_len)
+            kernels = generate_kernels_multi(seq_len, num_kernels, num_channels, kss=kss, seed=seed)
+            _apply_kernels = apply_kernels_multi
+        X_tfm_ref, direct = _timeit(_apply_kernels, X, kernels)
+        X_tfm_fft, fft = _timeit(apply_kernels_fft, X, kernels, method='fft')
+        X_tfm_auto, auto = _timeit(apply_kernels_fft, X, kernels, method='auto')
+        fft_kernels = sum(len(idxs) for idxs, d, f in bucket_costs(kernels, seq_len) if f < d)
+        rows.append({'seq_len': seq_len, 'direct (s)': direct, 'fft (s)': fft, 'auto (s)': auto,
+                     'fft kernels (auto)': fft_kernels / num_kernels,
+                     'max abs diff': max(np.abs(X_tfm_fft - X_tfm_ref).max(), np.abs(X_tfm_auto - X_tfm_ref).max())})
+    return pd.DataFrame(rows)
+
+
+def _per_kernel_conv1d(model):
+    # baseline: one nn.Conv1d per kernel (the original torch ROCKET) rebuilt from the packed buffers of model
+    convs = []
+    for i in range(model.n_kernels):
+        ks, dilation, padding = int(model.kernel_size[i]), int(model.dilation[i]), int(model.padding[i])
+        conv = nn.Conv1d(model.weight.shape[1], 1, ks, padding=padding, dilation=dilation, bias=True)
+        conv.weight = nn.Parameter(model.weight[i:i + 1, :, :ks].clone(), requires_grad=False)
+        conv.bias = nn.Parameter(model.bias[i:i + 1].clone(), requires_grad=False)
+        convs.append(conv)
+    return convs
+
+
+def _per_kernel_features(convs, x):
+    # max and ppv of each kernel, interleaved as in the ROCKET output. Series shorter than a kernel's span are zero
+    # padded on the right (1 output), as in ROCKET.forward_ragged
+    outputs = []
+    for conv in convs:
+        span = (conv.kernel_size[0] - 1) * conv.dilation[0]
+        out = conv(F.pad(x, (0, max(0, span + 1 - x.shape[-1] - 2 * conv.padding[0]))))
+        outputs += [out.max(dim=-1).values, torch.gt(out, 0).sum(dim=-1).float() / out.shape[-1]]
+    return torch.cat(outputs, dim=-1)
+
+
+def check_packed_parity(c_in=3, seq_len=200, n_kernels=100, batch_size=8, kss=[7, 9, 11], seed=1, atol=1e-5):
+    '''Checks that the packed torch ROCKET (forward, _forward_fused and forward_ragged) matches a per-kernel nn.Conv1d
+    baseline built from the same kernels. Returns the max abs difference of each path (raises if any is above atol).
+    Needs torchtimeseries importable (run from the repo root).'''
+    from torchtimeseries.models.ROCKET import ROCKET
+    torch.manual_seed(seed)
+    model = ROCKET(c_in, seq_len, n_kernels=n_kernels, kss=kss, seed=seed)
+    convs = _per_kernel_conv1d(model)
+    x = torch.randn(batch_size, c_in, seq_len)
+    with torch.no_grad():
+        expected = _per_kernel_features(convs, x)
+        diffs = {'forward': (model(x) - expected).abs().max().item()}
+        # a small memory budget so that the fused path splits the batch and the conv output into tiles
+        model.max_memory = 2**16
+        diffs['_forward_fused'] = (model(x) - expected).abs().max().item()
+        model.max_memory = None
+        # ragged: series of different lengths (some shorter than the longest kernels) concatenated along time
+        seq_lens = torch.randint(max(kss) // 2, seq_len + 1, (batch_size,)).tolist()
+        series = [torch.randn(c_in, l) for l in seq_lens]
+        offsets = torch.tensor([0] + seq_lens).cumsum(0)
+        expected = torch.cat([_per_kernel_features(convs, xi[None]) for xi in series])
+        diffs['forward_ragged'] = (model.forward_ragged(torch.cat(series, dim=-1), offsets) - expected).abs().max().item()
+    for name, diff in diffs.items(): assert diff <= atol, f'{name} differs from the per-kernel Conv1d baseline: {diff}'
+    return diffs
+
+
+def check_quantization(dsids=['Coffee', 'ECG200', 'GunPoint', 'OliveOil'], num_kernels=10000, parent_dir='data/UCR'):
+    '''Ridge accuracy on UCR datasets with float64 features and with quantized ones (uint8/ uint16 ppv, float16 max)
+    dequantized to float64, with the size of the train features'''
+    try: from exp.rocket_quantization import QuantizedFeatures
+    except ImportError: from .rocket_quantization import QuantizedFeatures
+    rows = []
+    for dsid in dsids:
+        X_train, y_train, X_valid, y_valid = _get_UCR_univariate(dsid, parent_dir=parent_dir)
+        kernels = generate_kernels(X_train.shape[-1], num_kernels)
+        X_train_tfm, X_valid_tfm = apply_kernels(X_train, kernels), apply_kernels(X_valid, kernels)
+        row = {'dataset': dsid, 'float64_accuracy': _ridge_score(X_train_tfm, y_train, X_valid_tfm, y_valid),
+               'float64 (MB)': X_train_tfm.nbytes / 2**20}
+        for ppv_dtype in [np.uint8, np.uint16]:
+            name = np.dtype(ppv_dtype).name
+            X_train_q = QuantizedFeatures.from_features(X_train_tfm, ppv_dtype=ppv_dtype)
+            X_valid_q = QuantizedFeatures.from_features(X_valid_tfm, ppv_dtype=ppv_dtype)
+            row[f'{name}_accuracy'] = _ridge_score(X_train_q.dequantize(np.float64), y_train,
+                                                   X_valid_q.dequantize(np.float64), y_valid)
+            row[f'{name} (MB)'] = X_train_q.nbytes / 2**20
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _read_arff_pandas(fname, classes=None):
+    # loadarff + DataFrame (the previous implementation of get_UCR_univariate), reference for benchmark_read_arff
+    df = pd.DataFrame(arff.loadarff(fname)[0])
+    unique_cats = df.iloc[:, -1].unique() if classes is None else classes
+    mapping = dict(zip(unique_cats, np.arange(len(unique_cats))))
+    df = df.replace({df.columns.values[-1]: mapping})
+    return df.iloc[:, :-1].values.astype(np.float32), df.iloc[:, -1].values.astype(int), list(unique_cats)
+
+
+def benchmark_read_arff(dsids=['FordA', 'ElectricDevices', 'StarLightCurves', 'HandOutlines'], parent_dir='data/UCR'):
+    '''Time and peak traced memory of reading the train and test sets of UCR datasets with loadarff + DataFrame and with
+    read_arff, and whether both return the same data'''
+    try: from exp.nb_TSDatasets import get_UCR_univariate, read_arff
+    except ImportError: from .nb_TSDatasets import get_UCR_univariate, read_arff
+    rows = []
+    for dsid in dsids:
+        if not os.path.isdir(Path(parent_dir) / dsid): get_UCR_univariate(dsid, parent_dir=parent_dir, cache=False)
+        for split in ['TRAIN', 'TEST']:
+            fname = os.path.join(parent_dir, dsid, f'{dsid}_{split}.arff')
+            row = {'dataset': dsid, 'split': split, 'file (MB)': os.path.getsize(fname) / 2**20}
+            outs = []
+            for name, reader in [('loadarff', _read_arff_pandas), ('read_arff', read_arff)]:
+                start = time.time()
+                outs.append(reader(fname))
+                row[f'{name} (s)'] = time.time() - start
+                # memory is measured in a separate run: tracing slows down python allocations
+                tracemalloc.start()
+                reader(fname)
+                row[f'{name} peak (MB)'] = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+            (X_ref, y_ref, _), (X, y, _) = outs
+            row['speedup'] = row['loadarff (s)'] / row['read_arff (s)']
+            row['equal'] = np.array_equal(X_ref, X, equal_nan=True) and np.array_equal(y_ref, y)
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def check_read_arff_blocks(n_samples=10, seq_len=20, seed=1):
+    '''Checks that read_arff returns the same data whatever its block_size, with blank and comment lines between samples
+    and a trailing blank line that falls alone in the last block'''
+    try: from exp.nb_TSDatasets import read_arff
+    except ImportError: from .nb_TSDatasets import read_arff
+    np.random.seed(seed)
+    X = np.random.randn(n_samples, seq_len).astype(np.float32)
+    labels = np.array(['a', 'b'])[np.random.randint(2, size=n_samples)]
+    # all data lines have the same length, so blocks of 2 lines leave the trailing blank line alone in the last block
+    lines = [','.join(f'{v:+.6e}' for v in x) + f',{label}\n' for x, label in zip(X, labels)]
+    header = '@relation check\n' + ''.join(f'@attribute att{i} numeric\n' for i in range(seq_len)) + \
+             '@attribute target {a,b}\n@data\n'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'check.arff')
+        with open(fname, 'w') as f: f.write(header + ''.join(lines[:3]) + '% comment\n\n' + ''.join(lines[3:]) + '\n')
+        for block_size in [2**22, 1, 2 * len(lines[0])]:
+            X_read, y, classes = read_arff(fname, block_size=block_size)
+            assert np.allclose(X_read, X) and np.array_equal(np.array(classes)[y], labels), \
+                f'read_arff with block_size={block_size} returned different data'
+    return True
+
+
+def check_ragged_from_padded(n_samples=6, n_channels=2, seq_len=20, seed=1):
+    '''Checks that RaggedTSList.from_padded gives each sample of a nan padded array the same length as to_ragged (0 for
+    an all nan sample), and that no nan is left in its values'''
+    try: from exp.nb_TSBasicData import RaggedTSList
+    except ImportError: from .nb_TSBasicData import RaggedTSList
+    np.random.seed(seed)
+    X = np.random.randn(n_samples, n_channels, seq_len).astype(np.float32)
+    lengths = np.random.randint(1, seq_len + 1, size=n_samples)
+    lengths[1] = 0 # all nan sample
+    for x, length in zip(X, lengths): x[:, length:] = np.nan
+    X[2, 0, lengths[2] - 1] = np.nan # missing value in one channel of the last step: still part of the series
+    ragged = RaggedTSList.from_padded(X)
+    assert np.array_equal(ragged.lengths, lengths), f'lengths {ragged.lengths} instead of {lengths}'
+    assert np.array_equal(np.diff(to_ragged(X)[1]), lengths)
+    assert np.isnan(ragged.values).sum() == 1, 'padding nans left in the values'
+    return True
@@ -0,0 +1,99 @@
+# On-disk cache of ROCKET features. Features are stored as .npy files named after a hash of the input data, the
+# kernels (or torch ROCKET module) and the transform, and are loaded back as read-only memory maps.
+
+import hashlib
+import os
+import numpy as np
+
+
+def _hash_array(h, arr, chunksize=2**24):
+    # large arrays (np.memmap) are hashed in chunks of rows to avoid a full copy
+    arr = np.asarray(arr)
+    h.update(f'{arr.shape}{arr.dtype}'.encode())
+    if arr.ndim == 0: arr = arr[None]
+    rows = max(1, chunksize // max(1, arr[0].nbytes))
+    for start in range(0, len(arr), rows): h.update(np.ascontiguousarray(arr[start:start + rows]).data)
+
+
+def _to_numpy(x):
+    if hasattr(x, 'detach'): return x.detach().cpu().numpy()
+    return np.asarray(x)
+
+
+def feature_hash(X, kernels=None, func=None, **kwargs):
+    "Hash of the input data, the kernels (or torch module), the transform name and its kwargs"
+    h = hashlib.blake2b(digest_size=20)
+    _hash_array(h, _to_numpy(X))
+    if hasattr(kernels, 'state_dict'):
+        # torch module: parameters/ buffers and conv settings (kernel size, dilation, padding)
+        h.update(repr(kernels).encode())
+        for name, v in kernels.state_dict().items():
+            h.update(name.encode())
+            _hash_array(h, _to_numpy(v))
+    elif kernels is not None:
+        for v in kernels: _hash_array(h, v)
+    if func is not None: h.update(getattr(func, '__name__', func.__class__.__name__).encode())
+    h.update(repr(sorted(kwargs.items())).encode())
+    return h.hexdigest()
+
+
+class FeatureCache():
+    '''Content-addressed cache of ROCKET features with least recently used eviction.
+
+    path: directory where features are stored.
+    max_size: max total size (bytes) of cached features. Least recently used files are removed when it's exceeded.
+
+    cache(apply_kernels, X, kernels) (or any function with the same signature, like apply_kernels_multi or
+    apply_minirocket) and cache(model, X) (torch ROCKET module) return the features (as a read-only np.memmap), which are
+    only computed if they are not already in the cache.
+    '''
+
+    def __init__(self, path='data/rocket_cache', max_size=20 * 2**30):
+        self.path, self.max_size = str(path), max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def _fname(self, key): return os.path.join(self.path, key + '.npy')
+
+    def __call__(self, func, X, kernels=None, **kwargs):
+        module = hasattr(func, 'state_dict')
+        key = feature_hash(X, func if module else kernels, None if module else func, **kwargs)
+        fname = self._fname(key)
+        if os.path.isfile(fname):
+            os.utime(fname) # last use
+            return np.load(fname, mmap_mode='r')
+        if module:
+            import torch
+            with torch.no_grad(): X_tfm = func(X if isinstance(X, torch.Tensor) else torch.as_tensor(X), **kwargs)
+        else: X_tfm = func(X, kernels, **kwargs)
+        self._save(fname, _to_numpy(X_tfm))
+        return np.load(fname, mmap_mode='r')
+
+    def _save(self, fname, X_tfm):
+        # written to a temporary file first so that an interrupted write never leaves a corrupt entry
+        tmp_fname = fname[:-len('.npy')] + '.tmp.npy'
+        np.save(tmp_fname, X_tfm)
+        os.replace(tmp_fname, fname)
+        self.evict()
+
+    def __contains__(self, key): return os.path.isfile(self._fname(key))
+
+    def entries(self):
+        "Cached files sorted from least to most recently used"
+        fnames = [os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith('.npy') and not f.endswith('.tmp.npy')]
+        return sorted(fnames, key=os.path.getmtime)
+
+    @property
+    def size(self): return sum(os.path.getsize(f) for f in self.entries())
+
+    def evict(self, max_size=None):
+        "Removes least recently used files until the cache size is <= max_size (default: self.max_size)"
+        max_size = self.max_size if max_size is None else max_size
+        fnames = self.entries()
+        size = sum(os.path.getsize(f) for f in fnames)
+        for fname in fnames[:-1]: # the most recent file is always kept
+            if size <= max_size: break
+            size -= os.path.getsize(fname)
+            os.remove(fname)
+
+    def clear(self):
+        for fname in self.entries(): os.remove(fname)
@@ -0,0 +1,152 @@
+# FFT engine for ROCKET on long series. The spectrum of each series (each channel) is computed once, zero padded to
+# a common FFT size, and reused by all the kernels: the output of a kernel is the inverse FFT of the product of the
+# series' and the (dilated) kernel's spectra. Its cost doesn't depend on the number of taps (kernel length x channels),
+# while the direct convolution (apply_kernels) is proportional to it. Kernels are grouped in buckets with the same
+# (length, dilation, padding) and each bucket runs on the engine that a cost model predicts is faster.
+
+import numpy as np
+from numba import njit, prange
+
+try:
+    from exp.rocket_functions import *
+    from exp.rocket_functions import _cast_kernels, _feature_codes, _numba_cache, _pooling
+except ImportError:
+    from .rocket_functions import *
+    from .rocket_functions import _cast_kernels, _feature_codes, _numba_cache, _pooling
+
+
+# cost model, in units of one direct multiply-add (numba, vectorized). Measured with numpy's FFT on a single CPU core:
+# - inverse real FFT of size n (+ pooling): _fft_cost * n * log2(n)
+# - product of spectra (per channel): _product_cost * n
+_fft_cost = .9
+_product_cost = 1.5
+
+
+def _next_fast_len(n):
+    # smallest 2^a 3^b 5^c >= n
+    best, p5 = 2 * n, 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n: p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def _buckets(kernels):
+    # (idxs, length, dilation, padding) of kernels grouped by (length, dilation, padding)
+    lengths, dilations, paddings = kernels[1], kernels[3], kernels[4]
+    keys, inverse = np.unique(np.stack([lengths, dilations, paddings], axis=1), axis=0, return_inverse=True)
+    order = np.argsort(inverse.ravel(), kind='stable')
+    counts = np.bincount(inverse.ravel(), minlength=len(keys))
+    return [(idxs, *key) for key, idxs in zip(keys.tolist(), np.split(order, np.cumsum(counts)[:-1]))]
+
+
+def bucket_costs(kernels, input_length, n_fft=None, batch_size=16):
+    '''Estimated cost per sample of each bucket of kernels with the direct and the FFT engines.
+    Returns a list of (idxs, direct cost, fft cost) (in units of one direct multiply-add).
+    '''
+    kernels = tuple(kernels)
+    multivariate = len(kernels) == 7
+    n_channels = kernels[0].shape[1] if multivariate else 1
+    n_fft = n_fft or _fft_size(kernels, input_length)
+    costs = []
+    for idxs, length, dilation, padding in _buckets(kernels):
+        output_length = max(input_length + 2 * padding - (length - 1) * dilation, 1)
+        taps = length * (kernels[5][idxs].mean() if multivariate else 1)
+        # per kernel: products and inverse FFT, + the kernel's own spectrum, shared by batch_size samples
+        fft = _fft_cost * n_fft * np.log2(n_fft) * (1 + n_channels / batch_size) + _product_cost * n_channels * n_fft
+        costs.append((idxs, len(idxs) * taps * output_length, len(idxs) * fft))
+    return costs
+
+
+def _fft_size(kernels, input_length):
+    # outputs of all kernels are free of circular wrap-around (see _apply_kernels_to_series for the padding)
+    lengths, dilations, paddings = kernels[1], kernels[3], kernels[4]
+    return _next_fast_len(max(input_length, ((lengths - 1) * dilations).max() + 1) + 2 * paddings.max())
+
+
+@njit(parallel = True, fastmath = True, cache = _numba_cache)
+def _pool_rows(C, starts, output_lengths, features, out):
+    # pooling features of each row of conv outputs C[i, starts[i]:starts[i] + output_lengths[i]]
+    for i in prange(len(C)):
+        _pooling(C[i, starts[i]:], output_lengths[i], features, out[i])
+
+
+def _dilated_kernels(weights, lengths, dilations, n_fft):
+    # (n_kernels, [n_channels,] n_fft) kernels with taps every dilation positions
+    h = np.zeros(weights.shape[:-1] + (n_fft,), dtype=weights.dtype)
+    k, j = np.nonzero(np.arange(weights.shape[-1]) < lengths[:, None])
+    h[k, ..., j * dilations[k]] = weights[k, ..., j]
+    return h
+
+
+def apply_kernels_fft(X, kernels, dtype=None, features=None, method='auto', batch_size=16, max_memory=2**28):
+    '''Same output as apply_kernels (or apply_kernels_multi), with each bucket of kernels computed with the direct or
+    FFT engine.
+
+    method: 'auto' (cost model, see bucket_costs), 'direct' or 'fft'.
+    batch_size: samples that share the spectra of the kernels (computed once per batch).
+    max_memory: max size (bytes) of the conv outputs of a batch (FFT kernels are processed in chunks that fit).
+    '''
+    kernels = _cast_kernels(kernels, dtype)
+    multivariate = len(kernels) == 7
+    weights, lengths, biases, dilations, paddings = kernels[:5]
+    X = np.asarray(X, dtype=weights.dtype)
+    codes = _feature_codes(features)
+    n_features, input_length = len(codes), X.shape[-1]
+    n_fft = _fft_size(kernels, input_length)
+    costs = bucket_costs(kernels, input_length, n_fft, batch_size)
+    if method == 'direct': use_fft = [False] * len(costs)
+    elif method == 'fft': use_fft = [True] * len(costs)
+    elif method == 'auto': use_fft = [fft < direct for _, direct, fft in costs]
+    else: raise ValueError(f'method {method} not supported')
+    output = np.zeros((len(X), len(weights) * n_features), dtype=weights.dtype)
+
+    # direct buckets: a single apply_kernels call
+    direct_idxs = np.sort(np.concatenate([idxs for (idxs, _, _), f in zip(costs, use_fft) if not f] + [[]])).astype(int)
+    if len(direct_idxs):
+        _apply_kernels = apply_kernels_multi if multivariate else apply_kernels
+        output[:, kernel_feature_idxs(direct_idxs, n_features)] = \
+            _apply_kernels(X, tuple(v[direct_idxs] for v in kernels), features=features)
+    fft_idxs = np.sort(np.concatenate([idxs for (idxs, _, _), f in zip(costs, use_fft) if f] + [[]])).astype(int)
+    if not len(fft_idxs): return output
+
+    # fft kernels: X is zero padded with the max padding on the left (the conv output of a kernel with padding p
+    # starts at max_padding - p) and to n_fft on the right
+    max_padding = paddings.max()
+    starts = max_padding - paddings
+    output_lengths = np.maximum(input_length + 2 * paddings - (lengths - 1) * dilations, 1)
+    n_channels = X.shape[1] if multivariate else 1
+    if multivariate:
+        # dense (n_kernels, n_channels, max length) weights, zero in the channels a kernel doesn't use
+        num_channel_indices, channel_indices = kernels[5:]
+        k, c = np.nonzero(np.arange(channel_indices.shape[1]) < num_channel_indices[:, None])
+        dense_weights = np.zeros((len(weights), n_channels, weights.shape[-1]), dtype=weights.dtype)
+        dense_weights[k, channel_indices[k, c]] = weights[k, c]
+    # conv outputs (and kernel spectra) of a chunk of kernels take at most max_memory
+    step = max(1, int(max_memory // ((batch_size + n_channels) * n_fft * weights.itemsize)))
+    chunks = np.array_split(fft_idxs, -(-len(fft_idxs) // step))
+    for start in range(0, len(X), batch_size):
+        x = X[start:start + batch_size]
+        spectra = np.fft.rfft(x, n=n_fft, axis=-1) if max_padding == 0 else \
+                  np.fft.rfft(np.concatenate([np.zeros(x.shape[:-1] + (max_padding,), dtype=x.dtype), x], axis=-1),
+                              n=n_fft, axis=-1)
+        for chunk in chunks:
+            h = _dilated_kernels(dense_weights[chunk] if multivariate else weights[chunk], lengths[chunk],
+                                 dilations[chunk], n_fft)
+            kernel_spectra = np.conj(np.fft.rfft(h, axis=-1))
+            if multivariate:
+                # sum over channels of the products of spectra: a (n_samples, n_channels) x (n_channels, n_kernels)
+                # matrix product per frequency
+                products = np.matmul(spectra.transpose(2, 0, 1), kernel_spectra.transpose(2, 1, 0)).transpose(1, 2, 0)
+            else: products = spectra[:, None] * kernel_spectra
+            C = np.fft.irfft(products, n=n_fft, axis=-1) + biases[chunk, None]
+            C = C.astype(weights.dtype, copy=False).reshape(-1, n_fft)
+            out = np.zeros((len(C), n_features), dtype=weights.dtype)
+            _pool_rows(C, np.tile(starts[chunk], len(x)), np.tile(output_lengths[chunk], len(x)), codes, out)
+            output[start:start + len(x), kernel_feature_idxs(chunk, n_features)] = out.reshape(len(x), -1)
+    return output
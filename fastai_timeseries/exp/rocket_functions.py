@@ -7,13 +7,39 @@
 # changes: 
 # - added kss parameter to generate_kernels
 # - convert X to np.float64
+# - added multivariate kernels (generate_kernels_multi, apply_kernels_multi)
+# - added apply_kernels_to_memmap (chunked, resumable feature extraction to disk)
+# - added dtype parameter (np.float32 or np.float64) to generate and apply kernels. X is only cast if its
+#   dtype differs from the kernels' dtype (the default float64 path is unchanged)
+# - apply_kernels pads each sample once (to the max padding) into a scratch buffer shared by all kernels, and
+#   runs kernels grouped by (length, dilation). apply_kernel is kept as the single kernel reference
+# - added seed parameter to generate kernels (deterministic, also when generated in parallel) and KernelSet, a
+#   kernel set that can be saved to / loaded from a single .npz file and used by both the numba and torch engines
+# - added StreamingROCKET (incremental features for sliding windows over a univariate stream)
+# - added apply_kernels_ragged (variable length series stored as values + offsets, see to_ragged)
+# - added features parameter to apply_kernels(_multi/ _ragged): pooling features other than ppv and max (mpv, mipv,
+#   lspv, see pooling_features) computed in the same pass over each convolution output
+# - numba's on-disk cache can be enabled with ROCKET_NUMBA_CACHE=1 (compiled code is reused across processes) and added
+#   warmup, which compiles the float32 and float64 versions ahead of the first call
 
 from numba import njit, prange
 import numpy as np
+import hashlib
+import os
+import time
 
-@njit
-def generate_kernels(input_length, num_kernels, kss=[7, 9, 11], pad=True, dilate=True):
-    candidate_lengths = np.array((kss))
+# numba's on-disk cache (cache=True) is opt-in: cached code refers to the name the module was imported under, and this
+# module is imported both as exp.rocket_functions and fastai_timeseries.exp.rocket_functions (loading code cached under
+# the other name fails). Set ROCKET_NUMBA_CACHE=1 only when the module is always imported under the same name.
+_numba_cache = os.environ.get('ROCKET_NUMBA_CACHE', '0') == '1'
+
+def _kernel_seeds(seed, num_kernels):
+    # one independent seed per kernel: kernels are the same whatever the order (or thread) in which they are drawn
+    if seed is None: return np.zeros(0, dtype = np.uint32)
+    return np.random.SeedSequence(seed).generate_state(num_kernels)
+
+@njit(parallel = True, cache = _numba_cache)
+def _generate_kernels(input_length, num_kernels, candidate_lengths, pad, dilate, seeds):
     # initialise kernel parameters
     weights = np.zeros((num_kernels, candidate_lengths.max())) # see note
     lengths = np.zeros(num_kernels, dtype = np.int32) # see note
@@ -21,7 +47,8 @@ def generate_kernels(input_length, num_kernels, kss=[7, 9, 11], pad=True, dilate
     dilations = np.zeros(num_kernels, dtype = np.int32)
     paddings = np.zeros(num_kernels, dtype = np.int32)
     # note: only the first *lengths[i]* values of *weights[i]* are used
-    for i in range(num_kernels):
+    for i in prange(num_kernels):
+        if len(seeds) > 0: np.random.seed(seeds[i])
         length = np.random.choice(candidate_lengths)
         _weights = np.random.normal(0, 1, length)
         bias = np.random.uniform(-1, 1)
@@ -33,18 +60,24 @@ def generate_kernels(input_length, num_kernels, kss=[7, 9, 11], pad=True, dilate
         lengths[i], biases[i], dilations[i], paddings[i] = length, bias, dilation, padding
     return weights, lengths, biases, dilations, paddings
 
-@njit(fastmath = True)
+def generate_kernels(input_length, num_kernels, kss=[7, 9, 11], pad=True, dilate=True, dtype=np.float64, seed=None):
+    # kernels are always drawn in float64 so that the same seed gives the same kernels for any dtype
+    weights, lengths, biases, dilations, paddings = \
+    _generate_kernels(input_length, num_kernels, np.array(kss), pad, dilate, _kernel_seeds(seed, num_kernels))
+    return weights.astype(dtype), lengths, biases.astype(dtype), dilations, paddings
+
+@njit(fastmath = True, cache = _numba_cache)
 def apply_kernel(X, weights, length, bias, dilation, padding):
     # zero padding
     if padding > 0:
         _input_length = len(X)
-        _X = np.zeros(_input_length + (2 * padding))
+        _X = np.zeros(_input_length + (2 * padding), dtype = X.dtype)
         _X[padding:(padding + _input_length)] = X
         X = _X
     input_length = len(X)
     output_length = input_length - ((length - 1) * dilation)
     _ppv = 0 # "proportion of positive values"
-    _max = np.NINF
+    _max = -np.inf
     for i in range(output_length):
         _sum = bias
         for j in range(length):
@@ -55,16 +88,492 @@ def apply_kernel(X, weights, length, bias, dilation, padding):
             _max = _sum
     return _ppv / output_length, _max
 
-@njit(parallel = True, fastmath = True)
-def apply_kernels(X, kernels):
-    X = X.astype(np.float64)
-    weights, lengths, biases, dilations, paddings = kernels
+@njit(fastmath = True, cache = _numba_cache)
+def _ppv_max(_out, output_length):
+    _ppv = 0 # "proportion of positive values"
+    _max = -np.inf
+    for t in range(output_length):
+        if _out[t] > 0:
+            _ppv += 1
+        if _out[t] > _max:
+            _max = _out[t]
+    return _ppv / output_length, _max
+
+# pooling features (codes are their positions in this list). Output columns of kernel j are
+# [j * len(features), (j + 1) * len(features)), in the order given by features. Default: ppv, max
+# - ppv: proportion of positive values
+# - max: max value
+# - mpv: mean of positive values (0 if there are none)
+# - mipv: mean of indices of positive values (-1 if there are none)
+# - lspv: longest stretch of positive values
+pooling_features = ['ppv', 'max', 'mpv', 'mipv', 'lspv']
+
+def _feature_codes(features):
+    if features is None: return np.arange(2, dtype = np.int64)
+    for f in features:
+        if f not in pooling_features: raise ValueError(f'feature {f} not supported (use {pooling_features})')
+    return np.array([pooling_features.index(f) for f in features], dtype = np.int64)
+
+def kernel_feature_idxs(kernel_idxs, n_features_per_kernel=2):
+    "Columns of the feature matrix that belong to kernel_idxs"
+    kernel_idxs = np.asarray(kernel_idxs)
+    return (kernel_idxs[:, None] * n_features_per_kernel + np.arange(n_features_per_kernel)).ravel()
+
+@njit(fastmath = True, cache = _numba_cache)
+def _pooling(_out, output_length, features, out):
+    # all the features in a single pass over the convolution output
+    _ppv = 0
+    _max = -np.inf
+    _sum = 0.
+    _idx = 0
+    _run = 0
+    _lspv = 0
+    for t in range(output_length):
+        # branchless updates
+        p = _out[t] > 0
+        _ppv += p
+        _sum += _out[t] * p
+        _idx += t * p
+        _run = (_run + 1) * p
+        _lspv = max(_lspv, _run)
+        _max = max(_max, _out[t])
+    for f in range(len(features)):
+        code = features[f]
+        if code == 0: out[f] = _ppv / output_length
+        elif code == 1: out[f] = _max
+        elif code == 2: out[f] = _sum / _ppv if _ppv > 0 else 0
+        elif code == 3: out[f] = _idx / _ppv if _ppv > 0 else -1
+        else: out[f] = _lspv
+
+@njit(fastmath = True, cache = _numba_cache)
+def _apply_kernels_to_series(x, weights, lengths, biases, dilations, paddings, order, max_padding, max_span, features,
+                             out):
+    # x: a single series. Writes the pooling features of each kernel to out.
+    # Scratch buffers: the series zero padded once to the max padding (shared by all kernels), and the convolution
+    # output. Kernels longer than the (padded) series see it zero padded on the right (1 output).
+    input_length = len(x)
+    _x = np.zeros(max(input_length, max_span + 1) + (2 * max_padding), dtype = x.dtype)
+    _x[max_padding:(max_padding + input_length)] = x
+    _out = np.empty(len(_x), dtype = x.dtype)
+    n = len(features)
+    ppv_max = n == 2 and features[0] == 0 and features[1] == 1
+    for j in order:
+        length, dilation, padding = lengths[j], dilations[j], paddings[j]
+        output_length = max(input_length + (2 * padding) - ((length - 1) * dilation), 1)
+        start = max_padding - padding
+        _out[:output_length] = biases[j]
+        for k in range(length):
+            # contiguous multiply-add over the output (vectorizable)
+            w, offset = weights[j, k], start + (k * dilation)
+            for t in range(output_length):
+                _out[t] += w * _x[offset + t]
+        if ppv_max: out[(j * 2):((j * 2) + 2)] = _ppv_max(_out, output_length)
+        else: _pooling(_out, output_length, features, out[(j * n):((j + 1) * n)])
+
+@njit(parallel = True, fastmath = True, cache = _numba_cache)
+def _apply_kernels(X, weights, lengths, biases, dilations, paddings, order, features):
+    num_examples = len(X)
+    num_kernels = len(weights)
+    max_padding, max_span = paddings.max(), ((lengths - 1) * dilations).max()
+    # initialise output
+    _X = np.zeros((num_examples, num_kernels * len(features)), dtype = X.dtype)
+    for i in prange(num_examples):
+        _apply_kernels_to_series(X[i], weights, lengths, biases, dilations, paddings, order, max_padding, max_span,
+                                 features, _X[i])
+    return _X
+
+@njit(parallel = True, fastmath = True, cache = _numba_cache)
+def _apply_kernels_ragged(values, offsets, weights, lengths, biases, dilations, paddings, order, features):
+    num_examples = len(offsets) - 1
+    num_kernels = len(weights)
+    max_padding, max_span = paddings.max(), ((lengths - 1) * dilations).max()
+    # initialise output
+    _X = np.zeros((num_examples, num_kernels * len(features)), dtype = values.dtype)
+    for i in prange(num_examples):
+        _apply_kernels_to_series(values[offsets[i]:offsets[i + 1]], weights, lengths, biases, dilations, paddings, order,
+                                 max_padding, max_span, features, _X[i])
+    return _X
+
+def _kernel_order(lengths, dilations):
+    # kernels sorted by (length, dilation) so that consecutive kernels run the same loops
+    return np.lexsort((dilations, lengths)).astype(np.int64)
+
+def _cast_kernels(kernels, dtype):
+    # weights and biases are the only float arrays in a kernel set
+    kernels = tuple(kernels)
+    if dtype is None: return kernels
+    return (kernels[0].astype(dtype, copy=False), kernels[1], kernels[2].astype(dtype, copy=False)) + kernels[3:]
+
+def apply_kernels(X, kernels, dtype=None, features=None):
+    # dtype defaults to the kernels' dtype. Output has the same dtype.
+    # features: list of pooling_features (default: ['ppv', 'max']), output is (n_samples, num_kernels * len(features))
+    weights, lengths, biases, dilations, paddings = _cast_kernels(kernels, dtype)
+    X = np.asarray(X, dtype=weights.dtype)
+    return _apply_kernels(X, weights, lengths, biases, dilations, paddings, _kernel_order(lengths, dilations),
+                          _feature_codes(features))
+
+
+# multivariate: each kernel is applied to a random subset of channels (weights are independent per channel)
+
+@njit(parallel = True, cache = _numba_cache)
+def _generate_kernels_multi(input_length, num_kernels, num_channels, candidate_lengths, pad, dilate, seeds):
+    # initialise kernel parameters
+    weights = np.zeros((num_kernels, num_channels, candidate_lengths.max())) # see note
+    lengths = np.zeros(num_kernels, dtype = np.int32) # see note
+    biases = np.zeros(num_kernels)
+    dilations = np.zeros(num_kernels, dtype = np.int32)
+    paddings = np.zeros(num_kernels, dtype = np.int32)
+    num_channel_indices = np.zeros(num_kernels, dtype = np.int32) # see note
+    channel_indices = np.zeros((num_kernels, num_channels), dtype = np.int32) # see note
+    # note: only the first *num_channel_indices[i]* rows of *weights[i]* and *channel_indices[i]* are used
+    for i in prange(num_kernels):
+        if len(seeds) > 0: np.random.seed(seeds[i])
+        length = np.random.choice(candidate_lengths)
+        limit = min(num_channels, length)
+        _num_channel_indices = np.int32(2 ** np.random.uniform(0, np.log2(limit + 1)))
+        _channel_indices = np.random.choice(num_channels, _num_channel_indices, replace = False)
+        for k in range(_num_channel_indices):
+            _weights = np.random.normal(0, 1, length)
+            weights[i, k, :length] = _weights - _weights.mean()
+        bias = np.random.uniform(-1, 1)
+        if dilate: dilation = 2 ** np.random.uniform(0, np.log2((input_length - 1) // (length - 1)))
+        else: dilation = 1
+        if pad: padding = ((length - 1) * dilation) // 2 if np.random.randint(2) == 1 else 0
+        else: padding = 0
+        lengths[i], biases[i], dilations[i], paddings[i] = length, bias, dilation, padding
+        num_channel_indices[i] = _num_channel_indices
+        channel_indices[i, :_num_channel_indices] = _channel_indices
+    return weights, lengths, biases, dilations, paddings, num_channel_indices, channel_indices
+
+def generate_kernels_multi(input_length, num_kernels, num_channels, kss=[7, 9, 11], pad=True, dilate=True,
+                           dtype=np.float64, seed=None):
+    weights, lengths, biases, dilations, paddings, num_channel_indices, channel_indices = \
+    _generate_kernels_multi(input_length, num_kernels, num_channels, np.array(kss), pad, dilate,
+                            _kernel_seeds(seed, num_kernels))
+    return (weights.astype(dtype), lengths, biases.astype(dtype), dilations, paddings,
+            num_channel_indices, channel_indices)
+
+@njit(fastmath = True, cache = _numba_cache)
+def apply_kernel_multi(X, weights, length, bias, dilation, padding, num_channel_indices, channel_indices):
+    # X: (n_channels, seq_len). padding is applied virtually (out of range positions count as zero)
+    input_length = X.shape[-1]
+    output_length = (input_length + (2 * padding)) - ((length - 1) * dilation)
+    _ppv = 0 # "proportion of positive values"
+    _max = -np.inf
+    for i in range(-padding, input_length + padding - ((length - 1) * dilation)):
+        _sum = bias
+        for j in range(length):
+            index = i + (j * dilation)
+            if index > -1 and index < input_length:
+                for k in range(num_channel_indices):
+                    _sum += weights[k, j] * X[channel_indices[k], index]
+        if _sum > 0:
+            _ppv += 1
+        if _sum > _max:
+            _max = _sum
+    return _ppv / output_length, _max
+
+@njit(fastmath = True, cache = _numba_cache)
+def _apply_kernels_multi_to_series(x, weights, lengths, biases, dilations, paddings, num_channel_indices, channel_indices,
+                                   order, max_padding, max_span, features, out):
+    # x: a single series (n_channels, seq_len). See _apply_kernels_to_series
+    num_channels, input_length = x.shape
+    _x = np.zeros((num_channels, max(input_length, max_span + 1) + (2 * max_padding)), dtype = x.dtype)
+    _x[:, max_padding:(max_padding + input_length)] = x
+    _out = np.empty(_x.shape[1], dtype = x.dtype)
+    n = len(features)
+    ppv_max = n == 2 and features[0] == 0 and features[1] == 1
+    for j in order:
+        length, dilation, padding = lengths[j], dilations[j], paddings[j]
+        output_length = max(input_length + (2 * padding) - ((length - 1) * dilation), 1)
+        start = max_padding - padding
+        _out[:output_length] = biases[j]
+        for c in range(num_channel_indices[j]):
+            channel = channel_indices[j, c]
+            for k in range(length):
+                w, offset = weights[j, c, k], start + (k * dilation)
+                for t in range(output_length):
+                    _out[t] += w * _x[channel, offset + t]
+        if ppv_max: out[(j * 2):((j * 2) + 2)] = _ppv_max(_out, output_length)
+        else: _pooling(_out, output_length, features, out[(j * n):((j + 1) * n)])
+
+@njit(parallel = True, fastmath = True, cache = _numba_cache)
+def _apply_kernels_multi(X, weights, lengths, biases, dilations, paddings, num_channel_indices, channel_indices, order,
+                         features):
     num_examples = len(X)
     num_kernels = len(weights)
+    max_padding, max_span = paddings.max(), ((lengths - 1) * dilations).max()
+    # initialise output
+    _X = np.zeros((num_examples, num_kernels * len(features)), dtype = X.dtype)
+    for i in prange(num_examples):
+        _apply_kernels_multi_to_series(X[i], weights, lengths, biases, dilations, paddings, num_channel_indices,
+                                       channel_indices, order, max_padding, max_span, features, _X[i])
+    return _X
+
+@njit(parallel = True, fastmath = True, cache = _numba_cache)
+def _apply_kernels_multi_ragged(values, offsets, weights, lengths, biases, dilations, paddings, num_channel_indices,
+                                channel_indices, order, features):
+    num_examples = len(offsets) - 1
+    num_kernels = len(weights)
+    max_padding, max_span = paddings.max(), ((lengths - 1) * dilations).max()
     # initialise output
-    _X = np.zeros((num_examples, num_kernels * 2)) # 2 features per kernel
+    _X = np.zeros((num_examples, num_kernels * len(features)), dtype = values.dtype)
     for i in prange(num_examples):
-        for j in range(num_kernels):
-            _X[i, (j * 2):((j * 2) + 2)] = \
-            apply_kernel(X[i], weights[j][:lengths[j]], lengths[j], biases[j], dilations[j], paddings[j])
-    return _X
\ No newline at end of file
+        _apply_kernels_multi_to_series(values[:, offsets[i]:offsets[i + 1]], weights, lengths, biases, dilations, paddings,
+                                       num_channel_indices, channel_indices, order, max_padding, max_span, features,
+                                       _X[i])
+    return _X
+
+def apply_kernels_multi(X, kernels, dtype=None, features=None):
+    # X: (n_samples, n_channels, seq_len). Output has the same layout as apply_kernels (default: (ppv, max) per kernel)
+    weights, lengths, biases, dilations, paddings, num_channel_indices, channel_indices = _cast_kernels(kernels, dtype)
+    X = np.asarray(X, dtype=weights.dtype)
+    return _apply_kernels_multi(X, weights, lengths, biases, dilations, paddings, num_channel_indices, channel_indices,
+                                _kernel_order(lengths, dilations), _feature_codes(features))
+
+
+# variable length series: all series concatenated along time (values) and the start of each one (offsets)
+
+def to_ragged(X, dtype=None):
+    """Returns (values, offsets) from a list of series ((seq_len,) or (n_channels, seq_len) arrays) or from a NaN padded
+    array ((n_samples, seq_len) or (n_samples, n_channels, seq_len)), where trailing NaNs are removed from each series.
+    values: (total_length,) or (n_channels, total_length). offsets: (n_samples + 1,), series i is values[..., offsets[i]:offsets[i + 1]]
+    """
+    if isinstance(X, np.ndarray) and X.dtype != 'O':
+        valid = ~np.isnan(X) if X.ndim == 2 else ~np.isnan(X).all(axis=1)
+        seq_lens = X.shape[-1] - np.argmax(valid[:, ::-1], axis=1)
+        seq_lens[~valid.any(axis=1)] = 0
+        X = [x[..., :seq_len] for x, seq_len in zip(X, seq_lens)]
+    offsets = np.concatenate([[0], np.cumsum([x.shape[-1] for x in X])]).astype(np.int64)
+    values = np.concatenate(X, axis=-1)
+    return values if dtype is None else values.astype(dtype), offsets
+
+def apply_kernels_ragged(values, offsets, kernels, dtype=None, features=None):
+    # same output as apply_kernels (or apply_kernels_multi) applied to each series, without padding them to the same
+    # length. ppv and max are computed over each series' own length
+    kernels = _cast_kernels(kernels, dtype)
+    values, offsets = np.asarray(values, dtype=kernels[0].dtype), np.asarray(offsets, dtype=np.int64)
+    order, features = _kernel_order(kernels[1], kernels[3]), _feature_codes(features)
+    if len(kernels) == 7: return _apply_kernels_multi_ragged(values, offsets, *kernels, order, features)
+    if values.ndim == 2:
+        assert len(values) == 1, 'univariate kernels require univariate series'
+        values = values[0]
+    return _apply_kernels_ragged(values, offsets, *kernels, order, features)
+
+
+
+class KernelSet():
+    "ROCKET kernels (univariate or multivariate) that can be saved to / loaded from a single .npz file"
+    _names = ['weights', 'lengths', 'biases', 'dilations', 'paddings', 'num_channel_indices', 'channel_indices']
+
+    def __init__(self, weights, lengths, biases, dilations, paddings, num_channel_indices=None, channel_indices=None,
+                 seed=None):
+        self.weights, self.lengths, self.biases, self.dilations, self.paddings = \
+        weights, lengths, biases, dilations, paddings
+        self.num_channel_indices, self.channel_indices = num_channel_indices, channel_indices
+        self.seed = seed
+
+    @classmethod
+    def generate(cls, input_length, num_kernels, num_channels=None, kss=[7, 9, 11], pad=True, dilate=True,
+                 dtype=np.float64, seed=None):
+        "Univariate kernels (generate_kernels) if num_channels is None, multivariate ones otherwise"
+        if num_channels is None:
+            kernels = generate_kernels(input_length, num_kernels, kss=kss, pad=pad, dilate=dilate, dtype=dtype, seed=seed)
+        else:
+            kernels = generate_kernels_multi(input_length, num_kernels, num_channels, kss=kss, pad=pad, dilate=dilate,
+                                             dtype=dtype, seed=seed)
+        return cls(*kernels, seed=seed)
+
+    @property
+    def multivariate(self): return self.channel_indices is not None
+
+    @property
+    def num_kernels(self): return len(self.weights)
+
+    def __iter__(self):
+        # same tuple as generate_kernels/ generate_kernels_multi, so a KernelSet can be passed to apply_kernels
+        return iter(tuple(getattr(self, name) for name in self._names[:7 if self.multivariate else 5]))
+
+    def __getitem__(self, idxs):
+        "Subset of kernels"
+        idxs = np.atleast_1d(np.arange(self.num_kernels)[idxs])
+        return self.__class__(*[v[idxs] for v in self], seed=self.seed)
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}(num_kernels={self.num_kernels}, multivariate={self.multivariate}, '
+                f'dtype={self.weights.dtype}, seed={self.seed})')
+
+    def astype(self, dtype):
+        return self.__class__(*_cast_kernels(self, dtype), seed=self.seed)
+
+    def save(self, fname):
+        arrays = {name: v for name, v in zip(self._names, self)}
+        np.savez(fname, seed=np.array(-1 if self.seed is None else self.seed), **arrays)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as data:
+            seed = int(data['seed'])
+            return cls(*[data[name] for name in cls._names if name in data], seed=None if seed == -1 else seed)
+
+
+def _memmap_fingerprint(X, kernels, features, n_rows=64):
+    # identifies the arguments of apply_kernels_to_memmap: shape and dtype of X with the bytes of n_rows evenly spaced
+    # samples (reading all of X would be as slow as the transform), the kernels and the features
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f'{X.shape}{X.dtype}{_feature_codes(features).tolist()}'.encode())
+    for i in np.unique(np.linspace(0, len(X) - 1, min(n_rows, len(X))).astype(np.int64)):
+        h.update(np.ascontiguousarray(X[i]).data)
+    for k in kernels: h.update(f'{k.shape}{k.dtype}'.encode()); h.update(np.ascontiguousarray(k).data)
+    return h.hexdigest()
+
+
+def apply_kernels_to_memmap(X, kernels, filename, chunksize=1000, dtype=None, verbose=True, features=None):
+    # X may be a np.memmap: only one chunk of samples is loaded (and cast to the kernels' dtype) at a time.
+    # Features are written to a .npy file (load it with np.load(filename, mmap_mode='r')). A fingerprint of the
+    # arguments and the number of samples already written are kept in filename + '.progress', so an interrupted run
+    # resumes where it stopped when called again with the same arguments (with different ones it starts over). The
+    # progress file is removed once all samples have been processed.
+    kernels = _cast_kernels(kernels, dtype)
+    _apply_kernels = apply_kernels_multi if len(kernels) == 7 else apply_kernels
+    num_examples, num_features = len(X), len(kernels[0]) * len(_feature_codes(features))
+    progress_file = str(filename) + '.progress'
+    fingerprint = _memmap_fingerprint(X, kernels, features)
+    done = None
+    if os.path.isfile(filename) and os.path.isfile(progress_file):
+        with open(progress_file) as f: progress = f.read().split()
+        if len(progress) == 2 and progress[0] == fingerprint:
+            _X = np.lib.format.open_memmap(filename, mode='r+')
+            done = int(progress[1])
+            if verbose: print(f'resuming from sample {done}/{num_examples}')
+        elif verbose: print(f'{progress_file} was written with different arguments: starting over')
+    if done is None:
+        done = 0
+        _X = np.lib.format.open_memmap(filename, mode='w+', dtype=kernels[0].dtype, shape=(num_examples, num_features))
+    start_time = time.time()
+    for start in range(done, num_examples, chunksize):
+        end = min(start + chunksize, num_examples)
+        _X[start:end] = _apply_kernels(X[start:end], kernels, features=features)
+        _X.flush()
+        with open(progress_file, 'w') as f: f.write(f'{fingerprint} {end}')
+        if verbose: print(f'{end}/{num_examples} samples ({end / num_examples:.1%}) - {time.time() - start_time:.1f}s')
+    if os.path.isfile(progress_file): os.remove(progress_file)
+    return _X
+
+
+@njit(parallel = True, fastmath = True, cache = _numba_cache)
+def _stream_update(buf, base, n_new, window_length, hop, first_window, weights, lengths, biases, dilations, paddings,
+                   _C, pos, lo, dq, dq_head, dq_tail, out):
+    # buf holds the stream from index base (last window_length samples seen + n_new new ones).
+    # For each kernel, _C is a ring (size window_length) with the outputs of the (unpadded) convolution over the stream,
+    # pos the number of positive outputs in [lo, newest output] and dq a monotonic deque (ring of stream indices) used
+    # for the running max. Each new sample costs O(length) per kernel, independently of the window length.
+    W = window_length
+    for k in prange(len(weights)):
+        length, dilation, padding, bias = lengths[k], dilations[k], paddings[k], biases[k]
+        span = (length - 1) * dilation
+        for step in range(n_new):
+            T = base + W + step # stream index of the new sample
+            s = T - span # stream index of the new convolution output
+            if s >= 0:
+                c = bias
+                for j in range(length):
+                    c += weights[k, j] * buf[s + (j * dilation) - base]
+                _C[k, s % W] = c
+                if c > 0: pos[k] += 1
+                while dq_tail[k] > dq_head[k] and _C[k, dq[k, (dq_tail[k] - 1) % W] % W] <= c: dq_tail[k] -= 1
+                dq[k, dq_tail[k] % W] = s
+                dq_tail[k] += 1
+            # remove outputs that are not part of any window ending at T or later
+            a = T + 1 - W
+            while lo[k] < a:
+                if _C[k, lo[k] % W] > 0: pos[k] -= 1
+                lo[k] += 1
+            while dq_tail[k] > dq_head[k] and dq[k, dq_head[k] % W] < a: dq_head[k] += 1
+            if a < 0 or a % hop != 0: continue
+            # window [a, T]: unpadded outputs come from the running aggregates, the 2 * padding outputs that use zero
+            # padding are computed here (only for padded kernels)
+            _ppv = pos[k]
+            _max = _C[k, dq[k, dq_head[k] % W] % W]
+            for e in range(2 * padding):
+                t = e - padding if e < padding else W - span + (e - padding)
+                c = bias
+                for j in range(length):
+                    index = t + (j * dilation)
+                    if index > -1 and index < W:
+                        c += weights[k, j] * buf[a + index - base]
+                if c > 0: _ppv += 1
+                if c > _max: _max = c
+            r = (a - first_window) // hop
+            out[r, k * 2] = _ppv / (W + (2 * padding) - span)
+            out[r, (k * 2) + 1] = _max
+
+
+class StreamingROCKET():
+    """Sliding window ROCKET features over a continuous univariate stream.
+
+    kernels: generate_kernels output (or a univariate KernelSet) generated with input_length=window_length.
+    Features of each window are the same as apply_kernels on that window. Call update with new samples (any number) to
+    get the features of all the windows (every hop samples) completed by them. The cost per new sample is proportional
+    to the sum of kernel lengths, independently of window_length. Padded kernels also need the 2 * padding outputs at
+    both ends of each emitted window, so use kernels generated with pad=False for a cost that only depends on the hop.
+    """
+
+    def __init__(self, kernels, window_length, hop=1, dtype=None):
+        self.kernels = _cast_kernels(kernels, dtype)
+        assert len(self.kernels) == 5, 'StreamingROCKET only supports univariate kernels'
+        weights, lengths, biases, dilations, paddings = self.kernels
+        assert ((lengths - 1) * dilations).max() < window_length, 'kernels are too long for this window_length'
+        self.window_length, self.hop, self.dtype = window_length, hop, weights.dtype
+        self.reset()
+
+    def reset(self):
+        num_kernels, W = len(self.kernels[0]), self.window_length
+        self.n_seen = 0
+        self._buf = np.zeros(W, dtype=self.dtype) # last window_length samples
+        self._C = np.zeros((num_kernels, W), dtype=self.dtype)
+        self._pos = np.zeros(num_kernels, dtype=np.int64)
+        self._lo = np.zeros(num_kernels, dtype=np.int64)
+        self._dq = np.zeros((num_kernels, W), dtype=np.int64)
+        self._dq_head = np.zeros(num_kernels, dtype=np.int64)
+        self._dq_tail = np.zeros(num_kernels, dtype=np.int64)
+
+    def update(self, x):
+        "Returns a (n_windows, 2 * num_kernels) array with the features of the windows completed by x"
+        x = np.asarray(x, dtype=self.dtype).ravel()
+        W, hop, n_new = self.window_length, self.hop, len(x)
+        # windows starting at a multiple of hop and ending within the new samples
+        first_window = max(0, self.n_seen + 1 - W)
+        first_window = -(-first_window // hop) * hop
+        last_window = self.n_seen + n_new - W
+        n_windows = max(0, (last_window - first_window) // hop + 1)
+        out = np.zeros((n_windows, len(self.kernels[0]) * 2), dtype=self.dtype)
+        buf = np.concatenate([self._buf, x])
+        _stream_update(buf, self.n_seen - W, n_new, W, hop, first_window, *self.kernels,
+                       self._C, self._pos, self._lo, self._dq, self._dq_head, self._dq_tail, out)
+        self._buf = buf[-W:]
+        self.n_seen += n_new
+        return out
+
+
+def warmup(dtypes=(np.float32, np.float64), multivariate=True, ragged=True, streaming=True, verbose=False):
+    """Compiles the numba functions for the given dtypes by running them on tiny inputs, so that the first real call
+    doesn't pay the JIT compilation. With ROCKET_NUMBA_CACHE=1, compiled code is cached on disk (in __pycache__ or
+    NUMBA_CACHE_DIR), so only the first process compiles and later ones just load it.
+    Returns the time (s) it took.
+    """
+    start = time.time()
+    input_length = 16
+    X = np.random.randn(2, input_length)
+    kernels = generate_kernels(input_length, 2, kss=[3], seed=0)
+    kernels_multi = generate_kernels_multi(input_length, 2, 2, kss=[3], seed=0) if multivariate else None
+    for dtype in dtypes:
+        apply_kernels(X, kernels, dtype=dtype)
+        if multivariate: apply_kernels_multi(np.stack([X, X], axis=1), kernels_multi, dtype=dtype)
+        if ragged:
+            apply_kernels_ragged(*to_ragged([X[0], X[1, :12]]), kernels, dtype=dtype)
+            if multivariate: apply_kernels_ragged(*to_ragged([X, X[:, :12]]), kernels_multi, dtype=dtype)
+        if streaming: StreamingROCKET(kernels, input_length, dtype=dtype).update(X[0])
+    duration = time.time() - start
+    if verbose: print(f'rocket_functions warmup: {duration:.2f}s')
+    return duration
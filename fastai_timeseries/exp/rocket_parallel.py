@@ -0,0 +1,97 @@
+# Multi-process ROCKET: X is shared once with all worker processes (through a memory mapped file in shared memory) and
+# each worker computes tiles of (samples x kernels) of the feature matrix, which are written directly to a shared
+# output. Useful when there are few samples and many kernels (numba prange in apply_kernels only parallelizes over
+# samples) or on multi-socket machines.
+
+import os
+import shutil
+import multiprocessing as mp
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+try:
+    from exp.rocket_functions import *
+    from exp.rocket_functions import _cast_kernels
+except ImportError:
+    from .rocket_functions import *
+    from .rocket_functions import _cast_kernels
+
+
+_worker = {}
+
+def _init_worker(numba_threads, dtypes):
+    if numba_threads is not None:
+        import numba
+        numba.set_num_threads(numba_threads)
+    # each process compiles the numba functions once (numba's on-disk cache is opt-in), before it runs any tile
+    if dtypes: warmup(dtypes=dtypes, ragged=False, streaming=False)
+
+def _run_tile(tmp_dir, start, end, kernel_idxs):
+    # the input, output and kernels of a call are shared through files in tmp_dir, loaded once per call by each worker
+    if _worker.get('tmp_dir') != tmp_dir:
+        with np.load(os.path.join(tmp_dir, 'kernels.npz')) as data:
+            kernels = tuple(data[f'arr_{i}'] for i in range(len(data.files)))
+        _worker.update(tmp_dir=tmp_dir, X=np.load(os.path.join(tmp_dir, 'X.npy'), mmap_mode='r'),
+                       out=np.load(os.path.join(tmp_dir, 'out.npy'), mmap_mode='r+'), kernels=kernels)
+    X, out, kernels = _worker['X'], _worker['out'], _worker['kernels']
+    _apply_kernels = apply_kernels_multi if len(kernels) == 7 else apply_kernels
+    out[start:end, kernel_feature_idxs(kernel_idxs)] = _apply_kernels(X[start:end], tuple(v[kernel_idxs] for v in kernels))
+
+
+def kernel_shards(kernels, input_length, n_shards):
+    "Splits kernels into n_shards disjoint groups of similar cost (length * output length)"
+    weights, lengths, biases, dilations, paddings = tuple(kernels)[:5]
+    cost = lengths * np.maximum(input_length + 2 * paddings - (lengths - 1) * dilations, 1)
+    order = np.argsort(-cost, kind='stable')
+    return [np.sort(order[i::n_shards]) for i in range(n_shards) if len(order[i::n_shards])]
+
+
+def rocket_pool(n_workers=None, numba_threads=1, dtypes=(np.float32, np.float64), mp_context=None):
+    '''Process pool for apply_kernels_parallel. Starting the processes and compiling the numba functions in each of
+    them (warmup) takes seconds, so a pool should be reused across calls: pass it as executor and shut it down when
+    done (or use it as a context manager).
+
+    numba_threads: numba threads used by each worker (1 avoids oversubscription).
+    dtypes: dtypes the workers compile the numba functions for when they start (None: compile at the first call).
+    mp_context: multiprocessing context. Default: 'forkserver' where available, as forking a process that has already
+        started numba's thread pool (any previous call to a parallel njit function) can deadlock the children.
+    '''
+    if mp_context is None:
+        mp_context = mp.get_context('forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn')
+    return ProcessPoolExecutor(n_workers or os.cpu_count(), mp_context=mp_context, initializer=_init_worker,
+                               initargs=(numba_threads, dtypes))
+
+
+def apply_kernels_parallel(X, kernels, n_workers=None, n_kernel_tiles=None, n_sample_tiles=1, numba_threads=1,
+                           dtype=None, mp_context=None, tmp_dir=None, executor=None):
+    '''Same output as apply_kernels (or apply_kernels_multi), computed by n_workers processes.
+
+    The feature matrix is split into n_sample_tiles x n_kernel_tiles tiles (default: one kernel shard per worker).
+    executor: pool (see rocket_pool) reused across calls. If None, a new pool of n_workers processes (with numba_threads
+        and mp_context) is started and shut down for this call only, and each process compiles the numba functions.
+    tmp_dir: where X and the output are shared (default: /dev/shm if available).
+    '''
+    kernels = _cast_kernels(kernels, dtype)
+    n_workers = n_workers or (executor._max_workers if executor is not None else os.cpu_count())
+    n_kernel_tiles = n_kernel_tiles or n_workers
+    if tmp_dir is None and os.path.isdir('/dev/shm'): tmp_dir = '/dev/shm'
+    tmp_dir = tempfile.mkdtemp(prefix='rocket_', dir=tmp_dir)
+    own_executor = executor is None
+    if own_executor:
+        # single use pool: workers only compile what this call runs (in their first tile)
+        executor = rocket_pool(n_workers, numba_threads=numba_threads, dtypes=None, mp_context=mp_context)
+    try:
+        np.save(os.path.join(tmp_dir, 'X.npy'), np.asarray(X, dtype=kernels[0].dtype))
+        np.savez(os.path.join(tmp_dir, 'kernels.npz'), *kernels)
+        out = np.lib.format.open_memmap(os.path.join(tmp_dir, 'out.npy'), mode='w+', dtype=kernels[0].dtype,
+                                        shape=(len(X), len(kernels[0]) * 2))
+        sample_tiles = np.array_split(np.arange(len(X)), n_sample_tiles)
+        kernel_tiles = kernel_shards(kernels, np.shape(X)[-1], n_kernel_tiles)
+        futures = [executor.submit(_run_tile, tmp_dir, samples[0], samples[-1] + 1, kernel_idxs)
+                   for samples in sample_tiles if len(samples) for kernel_idxs in kernel_tiles]
+        for future in futures: future.result()
+        return np.array(out)
+    finally:
+        if own_executor: executor.shutdown()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
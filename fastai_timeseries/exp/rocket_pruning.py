@@ -0,0 +1,95 @@
+# Kernel pruning for ROCKET: rank kernels by their contribution to a linear model fitted on ROCKET features and keep
+# only the most important ones. Works with both engines, as both return a fixed number of features per kernel
+# (rocket_functions: (ppv, max), torchtimeseries ROCKET: (max, ppv)) in kernel order.
+
+import time
+import numpy as np
+import pandas as pd
+
+try: from exp.rocket_functions import *
+except ImportError: from .rocket_functions import *
+
+
+def _get_coef(model):
+    # sklearn linear models (also the last step of a Pipeline)
+    if hasattr(model, 'steps'): model = model.steps[-1][1]
+    return np.atleast_2d(model.coef_)
+
+
+def kernel_importance(model, X_tfm=None, y=None, method='coef', n_features_per_kernel=2, n_repeats=1, seed=None):
+    '''Importance of each kernel (1d array of length n_kernels)
+
+    method='coef': sum of the absolute coefficients of the kernel's features (for all classes). If X_tfm is passed, each
+        coefficient is multiplied by the feature std, so that features with different scales (ppv, max) are comparable.
+        Don't pass X_tfm if the model already standardizes features (for example a StandardScaler in a Pipeline).
+    method='permutation': mean drop in model.score(X_tfm, y) when the kernel's features are shuffled (X_tfm and y are
+        required). This requires n_kernels * n_repeats evaluations of the model.
+    '''
+    if method == 'coef':
+        importance = np.abs(_get_coef(model))
+        if X_tfm is not None: importance = importance * np.asarray(X_tfm).std(axis=0)
+        return importance.sum(axis=0).reshape(-1, n_features_per_kernel).sum(axis=1)
+    elif method == 'permutation':
+        assert X_tfm is not None and y is not None, 'permutation importance requires X_tfm and y'
+        rng = np.random.RandomState(seed)
+        X_tfm = np.array(X_tfm)
+        n_kernels = X_tfm.shape[1] // n_features_per_kernel
+        baseline = model.score(X_tfm, y)
+        importance = np.zeros(n_kernels)
+        for i in range(n_kernels):
+            cols = kernel_feature_idxs([i], n_features_per_kernel)
+            orig = X_tfm[:, cols].copy()
+            for _ in range(n_repeats):
+                X_tfm[:, cols] = orig[rng.permutation(len(X_tfm))]
+                importance[i] += baseline - model.score(X_tfm, y)
+            X_tfm[:, cols] = orig
+        return importance / n_repeats
+    else: raise ValueError(f'method {method} not supported')
+
+
+def top_kernels(importance, n_kernels):
+    "Indices of the n_kernels most important kernels (in their original order)"
+    return np.sort(np.argsort(-np.asarray(importance), kind='stable')[:n_kernels])
+
+
+def prune_kernels(kernels, importance, n_kernels):
+    '''Returns the n_kernels most important kernels and their indices.
+
+    kernels can be a KernelSet, a generate_kernels(_multi) tuple or a torchtimeseries ROCKET module (which is pruned
+    in place). The returned indices can be used to slice existing feature matrices with kernel_feature_idxs.
+    '''
+    idxs = top_kernels(importance, n_kernels)
+    if isinstance(kernels, KernelSet): return kernels[idxs], idxs
+    elif hasattr(kernels, 'prune'): return kernels.prune(idxs), idxs
+    return tuple(v[idxs] for v in kernels), idxs
+
+
+def pruning_curve(kernels, X_train, y_train, X_valid, y_valid, n_kernels=[10000, 5000, 2000, 1000, 500, 200],
+                  X_train_tfm=None, X_valid_tfm=None, importance=None, alphas=np.logspace(-3, 3, 7)):
+    '''Accuracy and transform latency (on X_valid) of the numba engine when keeping the n most important kernels.
+
+    Kernels are ranked with the coefficients of a ridge classifier fitted on all the features. For each n, the classifier
+    is refitted on the pruned training features (sliced from X_train_tfm, not recomputed) and the valid features are
+    recomputed with the pruned kernels to measure latency.
+    '''
+    from sklearn.linear_model import RidgeClassifierCV
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    _apply_kernels = apply_kernels_multi if len(tuple(kernels)) == 7 else apply_kernels
+    if X_train_tfm is None: X_train_tfm = _apply_kernels(X_train, kernels)
+    if X_valid_tfm is None: X_valid_tfm = _apply_kernels(X_valid, kernels)
+    if importance is None:
+        model = make_pipeline(StandardScaler(), RidgeClassifierCV(alphas=alphas)).fit(X_train_tfm, y_train)
+        importance = kernel_importance(model)
+    rows = []
+    for n in n_kernels:
+        if n > len(importance): continue
+        pruned_kernels, idxs = prune_kernels(kernels, importance, n)
+        cols = kernel_feature_idxs(idxs)
+        model = make_pipeline(StandardScaler(), RidgeClassifierCV(alphas=alphas)).fit(X_train_tfm[:, cols], y_train)
+        start = time.time()
+        _X_valid_tfm = _apply_kernels(X_valid, pruned_kernels)
+        duration = time.time() - start
+        rows.append({'n_kernels': n, 'accuracy': model.score(_X_valid_tfm, y_valid), 'time (s)': duration,
+                     'time per sample (ms)': 1000 * duration / len(X_valid)})
+    return pd.DataFrame(rows)
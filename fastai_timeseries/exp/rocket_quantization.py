@@ -0,0 +1,90 @@
+# Compact storage of ROCKET features: ppv (a proportion in [0, 1]) as uint8/ uint16 fixed point and max (and the other
+# pooling features) as float16. With 10k kernels (20k features) a sample takes 30KB instead of 160KB in float64.
+
+import numpy as np
+
+try: from exp.rocket_functions import *
+except ImportError: from .rocket_functions import *
+
+
+class QuantizedFeatures():
+    '''ROCKET features (apply_kernels output) in reduced precision.
+
+    ppv: (n_samples, n_ppv) fixed point ppv (ppv * scale, rounded), with scale = max value of its unsigned int dtype.
+    values: (n_samples, n_values) the rest of the features (max, ...) in a low precision float dtype.
+    features: names of the features of each kernel in the original layout (default: ['ppv', 'max'], as apply_kernels.
+        Use ['max', 'ppv'] for torchtimeseries ROCKET outputs).
+
+    Slicing rows returns QuantizedFeatures, and np.asarray (or dequantize) returns the features in their original
+    layout. Models that process samples in chunks (like ChunkedRidgeClassifierCV) can be fitted on QuantizedFeatures
+    directly: only one chunk is dequantized at a time.
+    '''
+
+    def __init__(self, ppv, values, features=None):
+        self.ppv, self.values = ppv, values
+        self.features = list(features or ['ppv', 'max'])
+
+    @classmethod
+    def from_features(cls, X_tfm, features=None, ppv_dtype=np.uint8, values_dtype=np.float16, chunksize=10000):
+        "Quantizes X_tfm (which can be a np.memmap) chunksize samples at a time"
+        features = list(features or ['ppv', 'max'])
+        ppv_cols, value_cols = cls._columns(X_tfm.shape[1], features)
+        scale = np.iinfo(ppv_dtype).max
+        # float16 has a max of 65504: larger values are clipped instead of becoming inf
+        lim = np.finfo(values_dtype).max
+        ppv = np.empty((len(X_tfm), len(ppv_cols)), dtype=ppv_dtype)
+        values = np.empty((len(X_tfm), len(value_cols)), dtype=values_dtype)
+        for start in range(0, len(X_tfm), chunksize):
+            chunk = np.asarray(X_tfm[start:start + chunksize])
+            ppv[start:start + chunksize] = np.rint(np.clip(chunk[:, ppv_cols], 0, 1) * scale)
+            values[start:start + chunksize] = np.clip(chunk[:, value_cols], -lim, lim)
+        return cls(ppv, values, features)
+
+    @staticmethod
+    def _columns(n_columns, features):
+        # columns of ppv and of the rest of the features in the original layout
+        is_ppv = np.tile([f == 'ppv' for f in features], n_columns // len(features))
+        return np.nonzero(is_ppv)[0], np.nonzero(~is_ppv)[0]
+
+    @property
+    def shape(self): return (len(self.ppv), self.ppv.shape[1] + self.values.shape[1])
+
+    @property
+    def nbytes(self): return self.ppv.nbytes + self.values.nbytes
+
+    def __len__(self): return len(self.ppv)
+
+    def __getitem__(self, idxs): return self.__class__(self.ppv[idxs], self.values[idxs], self.features)
+
+    def dequantize(self, dtype=np.float32):
+        ppv_cols, value_cols = self._columns(self.shape[1], self.features)
+        X_tfm = np.empty(self.shape, dtype=dtype)
+        X_tfm[:, ppv_cols] = self.ppv / np.array(np.iinfo(self.ppv.dtype).max, dtype=dtype)
+        X_tfm[:, value_cols] = self.values
+        return X_tfm
+
+    def __array__(self, dtype=None, copy=None): return self.dequantize(np.float32 if dtype is None else dtype)
+
+    def save(self, fname):
+        np.savez(fname, ppv=self.ppv, values=self.values, features=np.array(self.features))
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as data: return cls(data['ppv'], data['values'], data['features'].tolist())
+
+
+def apply_kernels_quantized(X, kernels, chunksize=1000, features=None, ppv_dtype=np.uint8, values_dtype=np.float16,
+                            dtype=None):
+    '''apply_kernels (or apply_kernels_multi) output as QuantizedFeatures, computed chunksize samples at a time so that
+    the full precision features are never in memory at once.'''
+    kernels = tuple(kernels)
+    _apply_kernels = apply_kernels_multi if len(kernels) == 7 else apply_kernels
+    X_q = None
+    for start in range(0, len(X), chunksize):
+        chunk = QuantizedFeatures.from_features(_apply_kernels(X[start:start + chunksize], kernels, dtype=dtype,
+                                                               features=features), features, ppv_dtype, values_dtype)
+        if X_q is None:
+            X_q = QuantizedFeatures(np.empty((len(X), chunk.ppv.shape[1]), dtype=ppv_dtype),
+                                    np.empty((len(X), chunk.values.shape[1]), dtype=values_dtype), features)
+        X_q.ppv[start:start + chunksize], X_q.values[start:start + chunksize] = chunk.ppv, chunk.values
+    return X_q
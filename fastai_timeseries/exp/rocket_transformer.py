@@ -0,0 +1,87 @@
+# sklearn compatible ROCKET transformer around the numba functions in rocket_functions. It can be used in Pipelines
+# (for example with RidgeClassifierCV or ChunkedRidgeClassifierCV) and to stream features over batches of samples.
+
+import numpy as np
+
+try: from sklearn.base import BaseEstimator, TransformerMixin
+except ImportError: # sklearn is optional: the transformer can still be used on its own
+    class BaseEstimator(): pass
+    class TransformerMixin(): pass
+
+try:
+    from exp.rocket_functions import *
+    from exp.rocket_fft import apply_kernels_fft
+except ImportError:
+    from .rocket_functions import *
+    from .rocket_fft import apply_kernels_fft
+
+
+class ROCKETTransformer(TransformerMixin, BaseEstimator):
+    '''ROCKET features with the sklearn transformer interface.
+
+    fit(X) generates kernels for X's shape: univariate for (n_samples, seq_len) or (n_samples, 1, seq_len) arrays,
+    multivariate for (n_samples, n_channels, seq_len) ones. It only needs a batch of samples with the right shape.
+    transform(X) returns a (n_samples, num_kernels * len(features)) array (see pooling_features for the layout).
+
+    batch_size: if not None, samples are transformed batch_size at a time (X can be a np.memmap).
+    n_jobs: numba threads used by transform (None: numba's current setting, -1: all).
+    method: 'direct' (apply_kernels) or 'fft'/ 'auto' (apply_kernels_fft).
+    Other parameters are passed to KernelSet.generate (kss, pad, dilate, dtype, seed) and apply_kernels (features).
+
+    transform_batches(batches) transforms an iterable (for example a generator) of batches one at a time. Batches can
+    be arrays or (X, y) tuples, which are returned as (features, y), for example:
+        for X_tfm, y in tfm.transform_batches(batches): ridge.partial_fit(X_tfm, y, classes=classes)
+    '''
+
+    def __init__(self, num_kernels=10000, kss=[7, 9, 11], pad=True, dilate=True, dtype=np.float64, features=None,
+                 batch_size=None, n_jobs=None, method='direct', seed=None):
+        self.num_kernels, self.kss, self.pad, self.dilate, self.dtype = num_kernels, kss, pad, dilate, dtype
+        self.features, self.batch_size, self.n_jobs, self.method, self.seed = features, batch_size, n_jobs, method, seed
+
+    def _check_X(self, X):
+        # univariate kernels take (n_samples, seq_len) arrays
+        X = np.asarray(X)
+        if X.ndim == 3 and not self.kernels_.multivariate:
+            assert X.shape[1] == 1, 'univariate kernels require a single channel'
+            X = X[:, 0]
+        return X
+
+    def fit(self, X, y=None):
+        X = np.asarray(X)
+        assert X.ndim in (2, 3), 'X should be (n_samples, seq_len) or (n_samples, n_channels, seq_len)'
+        num_channels = X.shape[1] if X.ndim == 3 and X.shape[1] > 1 else None
+        self.kernels_ = KernelSet.generate(X.shape[-1], self.num_kernels, num_channels=num_channels, kss=self.kss,
+                                           pad=self.pad, dilate=self.dilate, dtype=self.dtype, seed=self.seed)
+        self.n_features_out_ = self.kernels_.num_kernels * len(self.features or ['ppv', 'max'])
+        return self
+
+    def _transform(self, X):
+        if self.method == 'direct':
+            _apply_kernels = apply_kernels_multi if self.kernels_.multivariate else apply_kernels
+            return _apply_kernels(X, self.kernels_, features=self.features)
+        return apply_kernels_fft(X, self.kernels_, features=self.features, method=self.method)
+
+    def transform(self, X):
+        import numba
+        X = self._check_X(X)
+        num_threads = numba.get_num_threads()
+        if self.n_jobs is not None:
+            numba.set_num_threads(numba.config.NUMBA_NUM_THREADS if self.n_jobs == -1 else
+                                  min(self.n_jobs, numba.config.NUMBA_NUM_THREADS))
+        try:
+            if self.batch_size is None: return self._transform(X)
+            X_tfm = np.empty((len(X), self.n_features_out_), dtype=self.kernels_.weights.dtype)
+            for start in range(0, len(X), self.batch_size):
+                X_tfm[start:start + self.batch_size] = self._transform(X[start:start + self.batch_size])
+            return X_tfm
+        finally: numba.set_num_threads(num_threads)
+
+    def transform_batches(self, batches):
+        "Generator of the features of each batch (or (features, y) for (X, y) batches)"
+        for batch in batches:
+            if isinstance(batch, tuple): yield (self.transform(batch[0]),) + tuple(batch[1:])
+            else: yield self.transform(batch)
+
+    def get_feature_names_out(self, input_features=None):
+        features = self.features or ['ppv', 'max']
+        return np.array([f'kernel{i}_{f}' for i in range(self.kernels_.num_kernels) for f in features], dtype=object)
@@ -5,40 +5,287 @@
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
 
+
+# pooling features. Output columns of kernel i are [i * len(features), (i + 1) * len(features)), in the order given by
+# features. Default: max, ppv (rocket_functions.pooling_features lists them in the numba default order, ppv first)
+# - max: max value
+# - ppv: proportion of positive values
+# - mpv: mean of positive values (0 if there are none)
+# - mipv: mean of indices of positive values (-1 if there are none)
+# - lspv: longest stretch of positive values
+torch_pooling_features = ['max', 'ppv', 'mpv', 'mipv', 'lspv']
+
+def _init_stats(out, features):
+    # running statistics over the conv output (batch, n_kernels, out_len) that are needed to compute features
+    shape = out.shape[:-1]
+    stats = {}
+    if 'max' in features: stats['max'] = out.new_full(shape, -np.inf)
+    if {'ppv', 'mpv', 'mipv'} & set(features): stats['pos'] = torch.zeros(shape, dtype=torch.long, device=out.device)
+    if 'mpv' in features: stats['sum'] = out.new_zeros(shape)
+    if 'mipv' in features: stats['idx'] = torch.zeros(shape, dtype=torch.long, device=out.device)
+    if 'lspv' in features:
+        stats['run'] = torch.zeros(shape, dtype=torch.long, device=out.device)
+        stats['lspv'] = torch.zeros(shape, dtype=torch.long, device=out.device)
+    return stats
+
+def _update_stats(stats, out, start=0):
+    # out: tile of the conv output that starts at output index start
+    if 'max' in stats: stats['max'] = torch.maximum(stats['max'], out.max(dim=-1).values)
+    if len(stats) == 1 and 'max' in stats: return stats
+    pos = torch.gt(out, 0)
+    if 'pos' in stats: stats['pos'] += pos.sum(dim=-1)
+    if 'sum' in stats: stats['sum'] += (out * pos).sum(dim=-1)
+    idxs = torch.arange(start, start + out.shape[-1], device=out.device)
+    if 'idx' in stats: stats['idx'] += (pos * idxs).sum(dim=-1)
+    if 'run' in stats:
+        # length of the positive run ending at each output: distance to the last non positive output (before this
+        # tile, positive outputs are the ones in the run carried from the previous tile)
+        last = torch.where(pos, (start - 1 - stats['run'])[..., None], idxs).cummax(dim=-1).values
+        runs = idxs - last
+        stats['lspv'] = torch.maximum(stats['lspv'], runs.max(dim=-1).values)
+        stats['run'] = runs[..., -1]
+    return stats
+
+def _stats_features(stats, features, out_len, dtype):
+    # list of (batch, n_kernels) tensors, one per feature
+    pos = stats.get('pos')
+    output = []
+    for f in features:
+        if f == 'max': output.append(stats['max'])
+        elif f == 'ppv': output.append(pos.to(dtype) / out_len)
+        elif f == 'mpv': output.append(torch.where(pos > 0, stats['sum'] / pos.clamp(min=1), 0).to(dtype))
+        elif f == 'mipv': output.append(torch.where(pos > 0, stats['idx'] / pos.clamp(min=1), -1).to(dtype))
+        elif f == 'lspv': output.append(stats['lspv'].to(dtype))
+    return output
+
+
+def _bytes_per_output(features, itemsize):
+    # peak memory of _update_stats per conv output: the output, the positive mask and the largest temporary of the
+    # features (they are computed one after the other): out * pos for mpv, pos * idxs (int64) for mipv and, for lspv,
+    # the torch.where result, cummax values and indices and the runs (int64)
+    nbytes = itemsize + (1 if set(features) - {'max'} else 0)
+    temporaries = [itemsize if 'mpv' in features else 0, 8 if 'mipv' in features else 0, 32 if 'lspv' in features else 0]
+    return nbytes + max(temporaries)
+
+
+def choose_tile_sizes(n_samples, n_kernels, c_in, out_len, span, max_memory, itemsize=4, min_tile_len=64,
+                      features=['max', 'ppv']):
+    '''
+    (batch_size, tile_len) for a fused ROCKET reduction so that the conv outputs of a group of n_kernels kernels, the
+    temporaries needed to compute features from them (and the input tile they are computed from) take at most
+    max_memory bytes. The whole batch is kept if tiles of at least min_tile_len outputs fit, otherwise the batch is
+    split. At least (1, 1) is returned.
+    '''
+    per_output = n_kernels * _bytes_per_output(features, itemsize) + c_in * itemsize # conv output + temporaries + input
+    def _tile_len(batch_size): return int((max_memory / batch_size - c_in * span * itemsize) // per_output)
+    tile_len = _tile_len(n_samples)
+    if tile_len >= min(out_len, min_tile_len): return n_samples, max(1, min(tile_len, out_len))
+    tile_len = min(out_len, min_tile_len)
+    batch_size = int(max(1, max_memory // (per_output * tile_len + c_in * span * itemsize)))
+    return batch_size, max(1, min(_tile_len(batch_size), out_len))
+
+
 class ROCKET(nn.Module):
-    def __init__(self, c_in, seq_len, n_kernels=10000, kss=[7, 9, 11]):
+    def __init__(self, c_in, seq_len, n_kernels=10000, kss=[7, 9, 11], packed=True, seed=None, kernels=None,
+                 max_memory=None, features=['max', 'ppv']):
         
         '''
         ROCKET is a GPU Pytorch implementation of the original ROCKET methods generate_kernels and apply_kernels that can be used with univariate and multivariate time series.
         Input: is a 3d torch tensor of type torch.float32. When used with univariate TS, make sure you transform the 2d to 3d by adding unsqueeze(1)
         c_in: number of channels in (features). For univariate c_in is 1.
         seq_len: sequence length (is the last dimension of the input)
+        packed: if True, kernels sharing (kernel size, dilation, padding) are run as a single batched convolution.
+            The output is the same as running each kernel separately (packed=False), but much faster.
+        seed: if not None, kernels are drawn from their own random generators instead of numpy's and torch's global ones.
+        kernels: optional numba kernels (output of generate_kernels, generate_kernels_multi or a KernelSet). When passed,
+            they are used instead of random ones (n_kernels, kss and seed are ignored), so that both engines use exactly the same kernels.
+        max_memory: if not None (bytes), the packed forward runs a fused reduction: the time axis is split in tiles and only
+            running statistics are kept, so peak memory doesn't depend on seq_len. Batch and tile sizes are chosen (see
+            choose_tile_sizes) so that the conv outputs of each group of kernels take at most max_memory.
+        features: pooling features computed for each kernel (see torch_pooling_features) in the same pass over its output.
+        Output: 2d tensor (batch, len(features) * n_kernels) with features for each kernel (default: (max, ppv)).
         '''
         super().__init__()
-        kss = [ks for ks in kss if ks < seq_len]
-        convs = nn.ModuleList()
-        for i in range(n_kernels):
-            ks = np.random.choice(kss)
-            dilation = 2**np.random.uniform(0, np.log2((seq_len - 1) // (ks - 1)))
-            padding = int((ks - 1) * dilation // 2) if np.random.randint(2) == 1 else 0
-            weight = torch.normal(0, 1, (1, c_in, ks))
-            weight -= weight.mean()
-            bias = 2 * (torch.rand(1) - .5)
-            layer = nn.Conv1d(c_in, 1, ks, padding=2 * padding, dilation=int(dilation), bias=True)
-            layer.weight = torch.nn.Parameter(weight, requires_grad=False)
-            layer.bias = torch.nn.Parameter(bias, requires_grad=False)
-            convs.append(layer)
-        self.convs = convs
-        self.n_kernels = n_kernels
+        if kernels is not None:
+            buffers = self._buffers_from_kernels(kernels, c_in)
+            kss = sorted(set(buffers['kernel_size'].tolist()))
+        else:
+            kss = [ks for ks in kss if ks < seq_len]
+            np_random = np.random if seed is None else np.random.RandomState(seed)
+            generator = None if seed is None else torch.Generator().manual_seed(seed)
+            ks = np_random.choice(kss, n_kernels)
+            dilation = 2**np_random.uniform(0, np.log2((seq_len - 1) // (ks - 1)))
+            padding = np.where(np_random.randint(2, size=n_kernels) == 1, (ks - 1) * dilation // 2, 0).astype(int)
+            # weights are zero padded to the max kernel size, mean is removed over each kernel's own weights
+            mask = torch.arange(max(kss)) < torch.as_tensor(ks)[:, None, None]
+            weight = torch.normal(0, 1, (n_kernels, c_in, max(kss)), generator=generator) * mask
+            weight = (weight - weight.sum(dim=(1, 2), keepdim=True) / mask.sum(dim=(1, 2), keepdim=True) / c_in) * mask
+            bias = 2 * (torch.rand(n_kernels, generator=generator) - .5)
+            buffers = dict(weight=weight, bias=bias, kernel_size=torch.as_tensor(ks),
+                           dilation=torch.as_tensor(dilation.astype(int)), padding=torch.as_tensor(2 * padding))
+        # kernels are stored as non-trainable buffers: weight (n_kernels, c_in, max kernel size) and per kernel bias,
+        # kernel_size, dilation and padding (conv1d padding on each side)
+        for name in self._buffer_names: self.register_buffer(name, buffers[name])
+        self.n_kernels = len(self.weight)
         self.kss = kss
+        self.packed = packed
+        self.max_memory = max_memory
+        for f in features: assert f in torch_pooling_features, f'feature {f} not supported (use {torch_pooling_features})'
+        self.features = list(features)
+        self._buckets = None
+
+    _buffer_names = ['weight', 'bias', 'kernel_size', 'dilation', 'padding']
+
+    @staticmethod
+    def _buffers_from_kernels(kernels, c_in):
+        # numba kernels pad each side with padding. Multivariate kernels get zero weights in the channels they don't use
+        kernels = tuple(kernels)
+        weights, lengths, biases, dilations, paddings = kernels[:5]
+        multivariate = len(kernels) == 7
+        assert multivariate or c_in == 1, 'univariate kernels can only be used with c_in=1'
+        weight = torch.zeros(len(weights), c_in, weights.shape[-1])
+        if multivariate:
+            num_channel_indices, channel_indices = kernels[5:]
+            k, j = np.nonzero(np.arange(channel_indices.shape[1]) < num_channel_indices[:, None])
+            weight[k, channel_indices[k, j]] = torch.as_tensor(weights[k, j], dtype=torch.float)
+        else: weight[:, 0] = torch.as_tensor(weights, dtype=torch.float)
+        return dict(weight=weight, bias=torch.as_tensor(biases, dtype=torch.float),
+                    kernel_size=torch.as_tensor(lengths, dtype=torch.long),
+                    dilation=torch.as_tensor(dilations, dtype=torch.long), padding=torch.as_tensor(paddings, dtype=torch.long))
+
+    def extra_repr(self):
+        return f'c_in={self.weight.shape[1]}, n_kernels={self.n_kernels}, kss={self.kss}, packed={self.packed}, max_memory={self.max_memory}, features={self.features}'
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # buffers take the shape of the checkpoint (for example a pruned model) and buckets are rebuilt
+        for name in self._buffer_names:
+            if prefix + name in state_dict:
+                setattr(self, name, torch.empty_like(state_dict[prefix + name], device=getattr(self, name).device))
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+        self.n_kernels = len(self.weight)
+        self._buckets = None
+
+    def prune(self, idxs):
+        "Keeps only the kernels in idxs (for example the most important ones for a linear model fitted on the output)"
+        idxs = torch.as_tensor(idxs, dtype=torch.long, device=self.weight.device)
+        for name in self._buffer_names: setattr(self, name, getattr(self, name)[idxs])
+        self.n_kernels = len(self.weight)
+        self._buckets = None
+        return self
+
+    def _pack(self):
+        # groups kernels by (ks, dilation, padding) so that each group is a single conv1d
+        meta = torch.stack([self.kernel_size, self.dilation, self.padding], dim=1)
+        keys, inverse = torch.unique(meta, dim=0, return_inverse=True)
+        order = torch.argsort(inverse, stable=True)
+        counts = torch.bincount(inverse, minlength=len(keys)).tolist()
+        buckets = []
+        for (ks, dilation, padding), idxs in zip(keys.tolist(), torch.split(order, counts)):
+            buckets.append((idxs, ks, dilation, padding))
+        self._buckets = buckets
+
+    def _get_buckets(self):
+        # buckets are (idxs, weight, bias, dilation, padding). Indices are cached, weights are sliced from the buffers at
+        # each call so that they follow .to(device/ dtype) and load_state_dict
+        if self._buckets is None or self._buckets[0][0].device != self.weight.device: self._pack()
+        return [(idxs, self.weight[idxs, :, :ks], self.bias[idxs], dilation, padding)
+                for idxs, ks, dilation, padding in self._buckets]
+
+    def _set_features(self, output, idxs, features):
+        # features: one (batch, len(idxs)) tensor per feature of kernels idxs
+        n = len(self.features)
+        for i, feature in enumerate(features): output[:, n * idxs + i] = feature
 
     def forward(self, x):
+        if not self.packed: return self._forward_per_kernel(x)
+        if self.max_memory is not None: return self._forward_fused(x)
+        output = x.new_empty(x.shape[0], len(self.features) * self.n_kernels)
+        for idxs, weight, bias, dilation, padding in self._get_buckets():
+            out = F.conv1d(x, weight, bias, padding=padding, dilation=dilation)
+            stats = _update_stats(_init_stats(out, self.features), out)
+            self._set_features(output, idxs, _stats_features(stats, self.features, out.shape[-1], out.dtype))
+        return output
+
+    def _forward_fused(self, x):
+        seq_len = x.shape[-1]
+        # every kernel needs at least one output
+        min_len = int(((self.kernel_size - 1) * self.dilation - 2 * self.padding).max()) + 1
+        if seq_len < min_len:
+            raise ValueError(f'input length {seq_len} is shorter than the span of some kernels: inputs need at least '
+                             f'{min_len} steps (forward_ragged zero pads short series)')
+        output = x.new_empty(x.shape[0], len(self.features) * self.n_kernels)
+        for idxs, weight, bias, dilation, padding in self._get_buckets():
+            span = (weight.shape[-1] - 1) * dilation
+            out_len = seq_len + 2 * padding - span
+            batch_size, tile_len = choose_tile_sizes(len(x), len(weight), x.shape[1], out_len, span, self.max_memory,
+                                                     x.element_size(), features=self.features)
+            for b in range(0, len(x), batch_size):
+                xb = x[b:b + batch_size]
+                stats = None
+                for start in range(0, out_len, tile_len):
+                    end = min(start + tile_len, out_len)
+                    if end - start == out_len: out = F.conv1d(xb, weight, bias, padding=padding, dilation=dilation)
+                    else:
+                        # input used by outputs start:end is x[lo:hi], zero padded where it's outside the series
+                        lo, hi = start - padding, end - padding + span
+                        left, right = max(0, min(hi, 0) - lo), max(0, hi - max(lo, seq_len))
+                        out = F.conv1d(F.pad(xb[..., max(lo, 0):max(min(hi, seq_len), 0)], (left, right)), weight, bias,
+                                       dilation=dilation)
+                    if stats is None: stats = _init_stats(out, self.features)
+                    stats = _update_stats(stats, out, start)
+                features = _stats_features(stats, self.features, out_len, x.dtype)
+                self._set_features(output[b:b + batch_size], idxs, features)
+        return output
+
+    def forward_ragged(self, values, offsets):
+        '''
+        Variable length input without padding to a common length.
+        values: (c_in, total_length) (or (total_length,) for univariate) tensor with all series concatenated along time.
+        offsets: (n_series + 1) tensor with the start of each series in values (the last one is total_length).
+        Output: (n_series, 2 * n_kernels) with max and ppv computed over each series' own length. Kernels longer than a
+            (padded) series see it zero padded on the right (1 output), as in rocket_functions.apply_kernels_ragged.
+            Only max and ppv features are supported.
+        '''
+        assert set(self.features) <= {'max', 'ppv'}, 'forward_ragged only supports max and ppv features'
+        if values.ndim == 1: values = values[None]
+        buckets = self._get_buckets()
+        offsets = torch.as_tensor(offsets, dtype=torch.long, device=values.device)
+        seq_lens = offsets[1:] - offsets[:-1]
+        n = len(seq_lens)
+        # series are separated by gaps of zeros at least as long as any kernel and any padding, so that each conv1d over
+        # the whole sequence sees each series padded with zeros (padding can exceed the kernel span, as it's computed
+        # from the dilation before rounding it down)
+        gap = int(torch.maximum((self.kernel_size - 1) * self.dilation, self.padding).max())
+        series_idxs = torch.repeat_interleave(torch.arange(n, device=values.device), seq_lens)
+        starts = offsets[:-1] + gap * (torch.arange(n, device=values.device) + 1)
+        flat = values.new_zeros(values.shape[0], values.shape[1] + gap * (n + 1))
+        flat[:, torch.arange(values.shape[1], device=values.device) + gap * (series_idxs + 1)] = values
+        output = values.new_empty(n, len(self.features) * self.n_kernels)
+        for idxs, weight, bias, dilation, padding in buckets:
+            out = F.conv1d(flat[None], weight, bias, dilation=dilation)[0]
+            span = (weight.shape[-1] - 1) * dilation
+            first = starts - padding
+            n_out = torch.clamp(seq_lens + 2 * padding - span, min=1)
+            # ppv: differences of the cumulative count of positive values
+            pos = F.pad(torch.cumsum(torch.gt(out, 0), dim=-1), (1, 0))
+            _ppv = ((pos[:, first + n_out] - pos[:, first]).to(out.dtype) / n_out).T
+            # max: segment max over each series' outputs
+            out_series_idxs = torch.repeat_interleave(torch.arange(n, device=values.device), n_out)
+            out_idxs = torch.arange(len(out_series_idxs), device=values.device) - \
+                       torch.repeat_interleave(torch.cumsum(n_out, 0) - n_out - first, n_out)
+            _max = out.new_full((out.shape[0], n), -np.inf)
+            _max.scatter_reduce_(1, out_series_idxs.expand(out.shape[0], -1), out[:, out_idxs], 'amax')
+            self._set_features(output, idxs, [_max.T if f == 'max' else _ppv for f in self.features])
+        return output
+
+    def _forward_per_kernel(self, x):
+        outputs = []
         for i in range(self.n_kernels):
-            out = self.convs[i](x)
-            _max = out.max(dim=-1).values
-            _ppv = torch.gt(out, 0).sum(dim=-1).float() / out.shape[-1]
-            cat = torch.cat((_max, _ppv), dim=-1)
-            output = cat if i == 0 else torch.cat((output, cat), dim=-1)
-        return output
\ No newline at end of file
+            ks, dilation, padding = int(self.kernel_size[i]), int(self.dilation[i]), int(self.padding[i])
+            out = F.conv1d(x, self.weight[i:i + 1, :, :ks], self.bias[i:i + 1], padding=padding, dilation=dilation)
+            stats = _update_stats(_init_stats(out, self.features), out)
+            outputs.append(torch.cat(_stats_features(stats, self.features, out.shape[-1], out.dtype), dim=-1))
+        return torch.cat(outputs, dim=-1)